@@ -7,6 +7,7 @@ import struct
 import re
 import sys
 import hashlib
+import zipfile
 from io import BytesIO
 import base64
 import uuid # Dùng để tạo ID cho khách vãng lai
@@ -14,7 +15,7 @@ import time
 import random
 from datetime import datetime
 from pathlib import Path
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_bcrypt import Bcrypt
@@ -22,6 +23,13 @@ from dotenv import load_dotenv
 from authlib.integrations.flask_client import OAuth
 from flask_mail import Mail, Message
 from threading import Thread # Dùng để gửi mail chạy ngầm
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import mpk_delta
+from shared_cache import SharedCache
+from db_pool import engine_options_from_env, install_pool_metrics, pool_metrics, aggregate_snapshots
+from oidc_cache import OIDCDocumentCache, cached_openid_app
 
 # Load biến môi trường
 load_dotenv()
@@ -42,13 +50,24 @@ mail = Mail(app)
 # --- CẤU HÌNH BẢO MẬT & DATABASE ---
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_key_khong_an_toan_123')
 
+# --- CACHE DÙNG CHUNG GIỮA CÁC WORKER (SQLite WAL) ---
+shared_cache = SharedCache(
+    os.environ.get('SHARED_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'wwm_shared_cache.sqlite3')),
+    max_bytes=int(os.environ.get('SHARED_CACHE_MAX_BYTES', 32 * 1024 * 1024)))
+CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', 300))
+LEADERBOARD_CACHE_TTL = int(os.environ.get('LEADERBOARD_CACHE_TTL', 60))
+
 # Google OAuth Configuration
+# Discovery + JWKS của Google được cache trên đĩa, dùng chung giữa các worker (xem oidc_cache.py)
+GOOGLE_METADATA_URL = os.environ.get('GOOGLE_METADATA_URL', 'https://accounts.google.com/.well-known/openid-configuration')
+oidc_documents = OIDCDocumentCache(shared_cache)
 oauth = OAuth(app)
 google = oauth.register(
     name='google',
     client_id=os.environ.get('GOOGLE_CLIENT_ID'),
     client_secret=os.environ.get('GOOGLE_CLIENT_SECRET'),
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+    server_metadata_url=GOOGLE_METADATA_URL,
+    client_cls=cached_openid_app(oidc_documents),
     client_kwargs={
         'scope': 'openid email profile'
     }
@@ -67,6 +86,9 @@ if database_url.startswith("postgres://"):
 
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool kết nối: pre-ping + recycle để không dính kết nối đã bị Postgres đóng khi idle,
+# giới hạn pool_size/max_overflow theo gói DB (xem db_pool.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(database_url)
 
 # Khởi tạo Extension
 db = SQLAlchemy(app)
@@ -76,6 +98,9 @@ login_manager.login_view = 'login'
 login_manager.login_message = "Vui lòng đăng nhập để sử dụng tính năng này."
 login_manager.login_message_category = "info"
 
+with app.app_context():
+    install_pool_metrics(db.engine)
+
 # --- DATABASE MODELS ---
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -110,6 +135,51 @@ class Donation(db.Model):
     # Quan hệ với User
     user = db.relationship('User', backref=db.backref('donations', lazy=True))
 
+# Bảng lưu trữ giao dịch/donate cũ (chuyển sang bằng: python maintain_orders.py archive)
+# Giữ nguyên id gốc, bảng chính và index của nó luôn nhỏ gọn
+class TransactionArchive(db.Model):
+    __tablename__ = 'transaction_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    order_code = db.Column(db.String(50), index=True)
+    user_id = db.Column(db.Integer, index=True)
+    amount = db.Column(db.Integer)
+    status = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DonationArchive(db.Model):
+    __tablename__ = 'donation_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, index=True)
+    amount = db.Column(db.Integer)
+    transaction_id = db.Column(db.String(100), unique=True)
+    timestamp = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Index phục vụ job hết hạn đơn PENDING (create_all không thêm index cho bảng đã có,
+# maintain_orders.py sẽ tạo nếu thiếu)
+transaction_status_created_index = db.Index('ix_transaction_status_created_at', Transaction.status, Transaction.created_at)
+
+def donation_exists(transaction_id):
+    """Giao dịch ngân hàng đã được ghi nhận chưa (kể cả đã chuyển sang archive)"""
+    return db.session.query(Donation.id).filter_by(transaction_id=transaction_id).first() is not None \
+        or db.session.query(DonationArchive.id).filter_by(transaction_id=transaction_id).first() is not None
+
+def invalidate_leaderboard():
+    """Xóa cache bảng xếp hạng sau khi cộng tiền. Tiền đã commit rồi nên lỗi cache (vd. database is locked)
+    chỉ ghi log, bảng xếp hạng tự cập nhật khi hết LEADERBOARD_CACHE_TTL"""
+    try:
+        shared_cache.invalidate('leaderboard')
+    except Exception as e:
+        print(f"⚠️ Không xóa được cache bảng xếp hạng: {e}")
+
+# Mẫu nội dung chuyển khoản (dùng chung cho webhook và đối soát sao kê)
+ORDER_CODE_RE = re.compile(r'(DH\d+)')
+WWM_USER_RE = re.compile(r'WWM\s+(\d+)\s+([a-f0-9]{32})', re.IGNORECASE)
+WWM_NEW_RE = re.compile(r'WWM\s+NEW\s+([a-f0-9]{32})', re.IGNORECASE)
+VIP_MIN_AMOUNT = 10000
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -119,106 +189,393 @@ def load_user(user_id):
 # --- Cấu HÌNH SHEET ---
 SHEET_URL = os.environ.get('SHEET_URL')
 
+def fetch_sheet():
+    df = pd.read_csv(SHEET_URL, dtype=str)
+    df.columns = df.columns.str.lower().str.strip()
+    df = df.dropna(subset=['platform'])
+    df = df.fillna("")
+    return df.to_dict('records')
+
 def get_data():
     if not SHEET_URL: return []
     try:
-        df = pd.read_csv(SHEET_URL, dtype=str)
-        df.columns = df.columns.str.lower().str.strip()
-        df = df.dropna(subset=['platform'])
-        df = df.fillna("")
-        return df.to_dict('records')
+        # Dùng chung giữa các worker: mỗi CATALOG_CACHE_TTL chỉ 1 worker tải lại Google Sheet
+        return shared_cache.get_or_refresh('catalog', SHEET_URL, fetch_sheet, CATALOG_CACHE_TTL)
     except: return []
 
-# --- CÁC CLASS XỬ LÝ FONT (GIẢ LẬP) ---
-# Bạn cần paste code SteamPatcher và LauncherPatcher thật vào đây
-# Ở đây mình viết hàm giả lập để code chạy được demo
-def process_font_logic(font_file_path, output_path):
-    """
-    Process font files according to requirements:
-    - Rename uploaded TTF file to normal.ttf
-    - Get title.ttf and art.ttf from /assets/ directory
-    - Package everything in the correct directory structure
-    """
-    import os
-    import zipfile
-    from pathlib import Path
-    
-    try:
-        # Create temporary directory for processing
-        temp_dir = os.path.dirname(output_path)
-        assets_dir = os.path.join(os.path.dirname(__file__), 'patch-font', 'assets')
-        
-        # Create directory structure
-        engine_dir = os.path.join(temp_dir, 'Engine')
-        content_dir = os.path.join(engine_dir, 'Content')
-        fonts_dir = os.path.join(content_dir, 'Fonts')
-        os.makedirs(fonts_dir, exist_ok=True)
-        
-        # 1. Rename uploaded TTF file to normal.ttf
-        normal_ttf_path = os.path.join(fonts_dir, 'normal.ttf')
-        shutil.copy(font_file_path, normal_ttf_path)
-        
-        # 2. Copy title.ttf and art.ttf from assets directory
-        title_src = os.path.join(assets_dir, 'title.ttf')
-        art_src = os.path.join(assets_dir, 'art.ttf')
-        
-        title_dst = os.path.join(fonts_dir, 'title.ttf')
-        art_dst = os.path.join(fonts_dir, 'art.ttf')
-        
-        # Copy if files exist in assets
-        if os.path.exists(title_src):
-            shutil.copy(title_src, title_dst)
-        else:
-            # Fallback: copy normal.ttf as title.ttf if title.ttf not found
-            shutil.copy(normal_ttf_path, title_dst)
-            
-        if os.path.exists(art_src):
-            shutil.copy(art_src, art_dst)
-        else:
-            # Fallback: copy normal.ttf as art.ttf if art.ttf not found
-            shutil.copy(normal_ttf_path, art_dst)
-        
-        # 3. Create Fonts.xml file
-        fonts_xml_content = '''<?xml version="1.0" encoding="UTF-8"?>
+# --- CẤU HÌNH BUNDLE (Resources.mpk + Fonts) ---
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), 'patch-font', 'assets')
+# File Resources.mpk thật nằm trên server (vài trăm MB), không commit vào repo
+RESOURCES_MPK_PATH = os.environ.get('RESOURCES_MPK_PATH', os.path.join(os.path.dirname(__file__), 'patch-font', 'Resources.mpk'))
+# Máy dev chưa có Resources.mpk: ALLOW_PLACEHOLDER_MPK=1 để đóng gói với file giả
+ALLOW_PLACEHOLDER_MPK = os.environ.get('ALLOW_PLACEHOLDER_MPK', '0') == '1'
+# Thư mục lưu các bundle đã đóng gói, đặt tên theo mã hash nội dung để tải lại/tải tiếp
+BUNDLE_DIR = os.environ.get('BUNDLE_DIR', os.path.join(tempfile.gettempdir(), 'wwm_bundles'))
+BUNDLE_NAME = 'WWM_VietHoa_Full.zip'
+FONTS_XML_CONTENT = '''<?xml version="1.0" encoding="UTF-8"?>
 <Root>
     <Font><Name>NormalFont</Name><File>normal.ttf</File></Font>
     <Font><Name>TitleFont</Name><File>title.ttf</File></Font>
     <Font><Name>ArtFont</Name><File>art.ttf</File></Font>
 </Root>'''
-        
-        fonts_xml_path = os.path.join(fonts_dir, 'Fonts.xml')
-        with open(fonts_xml_path, 'w', encoding='utf-8') as f:
-            f.write(fonts_xml_content)
-        
-        # 4. Create Resources.mpk placeholder
-        resources_path = os.path.join(temp_dir, 'Resources.mpk')
-        with open(resources_path, 'w') as f:
-            f.write('This is a placeholder for Resources.mpk')
-        
-        # 5. Create ZIP file with correct structure
+# Cố định thời gian trong ZIP để cùng đầu vào luôn ra cùng một file (ETag ổn định giữa các worker)
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+COPY_CHUNK = 1024 * 1024
+
+def _zip_entry(arc_path, compress_type):
+    info = zipfile.ZipInfo(arc_path, date_time=ZIP_EPOCH)
+    info.compress_type = compress_type
+    info.external_attr = 0o644 << 16
+    return info
+
+def _zip_add_file(zipf, src_path, arc_path, compress_type=zipfile.ZIP_DEFLATED):
+    """Ghi file vào ZIP theo từng khối, không đọc cả file vào RAM"""
+    with open(src_path, 'rb') as src, zipf.open(_zip_entry(arc_path, compress_type), 'w', force_zip64=True) as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK)
+
+def _hash_file(path, h):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK), b''):
+            h.update(chunk)
+    return h
+
+# path -> (size, mtime_ns, sha256): chỉ đọc lại file khi size/mtime đổi
+_asset_hashes = {}
+_asset_hashes_lock = Lock()
+
+def _content_hash(path):
+    st = os.stat(path)
+    cached = _asset_hashes.get(path)
+    if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+        return cached[2]
+    with _asset_hashes_lock:
+        cached = _asset_hashes.get(path)
+        if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+            return cached[2]
+        digest = _hash_file(path, hashlib.sha256()).hexdigest()
+        _asset_hashes[path] = (st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+def _cached_content_hash(path):
+    """Như _content_hash nhưng không bao giờ đọc file: chưa có hash khớp size/mtime thì LookupError"""
+    st = os.stat(path)
+    cached = _asset_hashes.get(path)
+    if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+        return cached[2]
+    raise LookupError(path)
+
+def _asset_paths():
+    return (RESOURCES_MPK_PATH, os.path.join(ASSETS_DIR, 'title.ttf'), os.path.join(ASSETS_DIR, 'art.ttf'))
+
+def _fingerprint(content_hash):
+    parts = []
+    for path in _asset_paths():
+        try:
+            parts.append(f"{os.path.basename(path)}:{content_hash(path)}")
+        except OSError:
+            parts.append(f"{os.path.basename(path)}:missing")
+    return "|".join(parts)
+
+def assets_fingerprint():
+    """
+    Dấu vân tay theo nội dung Resources.mpk/title/art: deploy hay checkout lại (đổi mtime)
+    không làm đổi bundle_id/ETag và không làm mất bundle dựng sẵn
+    """
+    return _fingerprint(_content_hash)
+
+# Pool dùng chung cho đóng gói hàng loạt (nén zlib và ghi file nhả GIL nên thread là đủ)
+BUNDLE_WORKERS = int(os.environ.get('BUNDLE_WORKERS', min(4, os.cpu_count() or 1)))
+MAX_BATCH_SETS = int(os.environ.get('MAX_BATCH_SETS', 20))
+FONT_ROLES = ('normal', 'title', 'art')
+bundle_pool = ThreadPoolExecutor(max_workers=BUNDLE_WORKERS, thread_name_prefix='bundle')
+
+def _remove_when_done(futures, path):
+    """Xóa thư mục path sau khi mọi future đã xong hoặc bị hủy (future xong cuối cùng sẽ xóa)"""
+    if not futures:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    remaining = [len(futures)]
+    lock = Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            shutil.rmtree(path, ignore_errors=True)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+# Thư mục chứa các bản cập nhật delta (tạo offline bằng: python mpk_delta.py build ...)
+DELTA_DIR = os.environ.get('DELTA_DIR', os.path.join(os.path.dirname(__file__), 'deltas'))
+
+def attach_deltas(versions):
+    """Gắn thông tin delta (nếu có) vào từng phiên bản theo cột version_name"""
+    by_version = {}
+    for entry in mpk_delta.load_manifest(DELTA_DIR):
+        by_version.setdefault(str(entry.get('to_version', '')).strip(), []).append(entry)
+    for item in versions:
+        item['deltas'] = by_version.get(str(item.get('version_name', '')).strip(), [])
+    return versions
+
+# Danh mục bundle dựng sẵn cho font phổ biến (tạo bằng: python build_prebuilt.py <manifest>)
+PREBUILT_INDEX = os.environ.get('PREBUILT_INDEX', os.path.join(BUNDLE_DIR, 'prebuilt.json'))
+
+def load_prebuilt_index(index_path=PREBUILT_INDEX):
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def assets_stamp_path(index_path=PREBUILT_INDEX):
+    """File lưu hash assets (kèm size/mtime) cạnh danh mục bundle dựng sẵn"""
+    return os.path.join(os.path.dirname(os.path.abspath(index_path)), 'assets_fingerprint.json')
+
+def save_assets_stamp(stamp_path=None):
+    """Hash assets (đọc lại file nếu size/mtime đổi) rồi ghi ra stamp, trả về dấu vân tay"""
+    fingerprint = assets_fingerprint()
+    files = {path: list(_asset_hashes[path]) for path in _asset_paths() if path in _asset_hashes}
+    stamp_path = stamp_path or assets_stamp_path()
+    os.makedirs(os.path.dirname(stamp_path), exist_ok=True)
+    tmp_path = f"{stamp_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'fingerprint': fingerprint, 'files': files}, f, indent=2)
+    os.replace(tmp_path, stamp_path)
+    return fingerprint
+
+def _load_assets_stamp(stamp_path=None):
+    """Nạp hash từ stamp vào _asset_hashes, chỉ những file còn đúng size/mtime lúc ghi stamp"""
+    try:
+        with open(stamp_path or assets_stamp_path(), encoding='utf-8') as f:
+            files = json.load(f).get('files', {})
+        for path, (size, mtime_ns, digest) in files.items():
+            st = os.stat(path)
+            if (st.st_size, st.st_mtime_ns) == (size, mtime_ns):
+                _asset_hashes[path] = (size, mtime_ns, digest)
+    except (OSError, ValueError, TypeError, AttributeError):
+        pass
+
+_assets_warmup_pid = None
+_assets_warmup_lock = Lock()
+
+def _warm_assets():
+    global _assets_warmup_pid
+    try:
+        save_assets_stamp()
+    except Exception as e:
+        print(f"Error hashing assets: {e}")
+    finally:
+        _assets_warmup_pid = None
+
+def current_assets_fingerprint():
+    """
+    Dấu vân tay assets cho request: chỉ stat file, lấy hash từ bộ nhớ hoặc stamp.
+    Assets đổi mà chưa có hash thì hash ở thread nền (1 thread mỗi process) và trả None.
+    """
+    try:
+        return _fingerprint(_cached_content_hash)
+    except LookupError:
+        pass
+    _load_assets_stamp()
+    try:
+        return _fingerprint(_cached_content_hash)
+    except LookupError:
+        pass
+    global _assets_warmup_pid
+    with _assets_warmup_lock:
+        if _assets_warmup_pid != os.getpid():
+            _assets_warmup_pid = os.getpid()
+            Thread(target=_warm_assets, name='assets-hash', daemon=True).start()
+    return None
+
+def available_prebuilt():
+    """
+    Bundle dựng sẵn còn dùng được: file còn trên đĩa và được đóng gói với assets hiện tại.
+    Chưa biết hash assets hiện tại (đang hash ở thread nền) thì tạm không đưa bundle nào.
+    """
+    fingerprint = current_assets_fingerprint()
+    if fingerprint is None:
+        return []
+    return [entry for entry in load_prebuilt_index()
+            if entry.get('assets') == fingerprint and os.path.exists(bundle_path(entry['bundle_id']))]
+
+def bundle_path(bundle_id):
+    return os.path.join(BUNDLE_DIR, f"{bundle_id}.zip")
+
+def process_font_logic(font_file_path, output_path, title_file_path=None, art_file_path=None):
+    """
+    Process font files according to requirements:
+    - Rename uploaded TTF file to normal.ttf
+    - Use the given title/art fonts, otherwise title.ttf and art.ttf from /assets/ directory
+    - Package everything together with the real Resources.mpk
+    The archive is deterministic: same inputs always produce the same bytes.
+    """
+    try:
+        title_src = title_file_path or os.path.join(ASSETS_DIR, 'title.ttf')
+        art_src = art_file_path or os.path.join(ASSETS_DIR, 'art.ttf')
+
         with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add Resources.mpk
-            zipf.write(resources_path, 'Resources.mpk')
-            
-            # Add font files and Fonts.xml
-            for root, dirs, files in os.walk(engine_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arc_path = os.path.relpath(file_path, temp_dir)
-                    zipf.write(file_path, arc_path)
-        
+            # 1. Resources.mpk thật (đã nén sẵn nên lưu dạng STORED cho nhanh)
+            if os.path.exists(RESOURCES_MPK_PATH):
+                _zip_add_file(zipf, RESOURCES_MPK_PATH, 'Resources.mpk', zipfile.ZIP_STORED)
+            elif ALLOW_PLACEHOLDER_MPK:
+                # Chỉ dùng ở máy dev chưa có file gốc
+                print(f"Warning: {RESOURCES_MPK_PATH} not found, using placeholder Resources.mpk")
+                zipf.writestr(_zip_entry('Resources.mpk', zipfile.ZIP_STORED), 'This is a placeholder for Resources.mpk')
+            else:
+                # Không đóng gói (và không cache, không trừ lượt) bundle thiếu Resources.mpk
+                print(f"Error in process_font_logic: {RESOURCES_MPK_PATH} not found")
+                return False
+
+            fonts_dir = 'Engine/Content/Fonts'
+            # 2. File font người dùng tải lên -> normal.ttf
+            _zip_add_file(zipf, font_file_path, f'{fonts_dir}/normal.ttf')
+
+            # 3. title.ttf và art.ttf từ assets (fallback: dùng lại font người dùng)
+            _zip_add_file(zipf, title_src if os.path.exists(title_src) else font_file_path, f'{fonts_dir}/title.ttf')
+            _zip_add_file(zipf, art_src if os.path.exists(art_src) else font_file_path, f'{fonts_dir}/art.ttf')
+
+            # 4. Fonts.xml
+            zipf.writestr(_zip_entry(f'{fonts_dir}/Fonts.xml', zipfile.ZIP_DEFLATED), FONTS_XML_CONTENT)
+
         return True
     except Exception as e:
         print(f"Error in process_font_logic: {e}")
         return False
 
+def build_bundle(font_file_path, title_file_path=None, art_file_path=None, fingerprint=None):
+    """Đóng gói bundle vào BUNDLE_DIR, trả về bundle_id (sha256) hoặc None nếu lỗi"""
+    # Mỗi vai trò font được hash riêng (digest độ dài cố định) rồi mới ghép,
+    # để nội dung file không thể "giả" thành ranh giới giữa normal/title/art
+    h = hashlib.sha256(b'wwm-bundle-v2')
+    for role, path in (('normal', font_file_path), ('title', title_file_path), ('art', art_file_path)):
+        h.update(role.encode() + b'\0')
+        h.update(_hash_file(path, hashlib.sha256()).digest() if path else b'\0' * 32)
+    h.update((fingerprint or assets_fingerprint()).encode())
+    bundle_id = h.hexdigest()
+
+    final_path = bundle_path(bundle_id)
+    if os.path.exists(final_path):
+        _touch(final_path)
+        return bundle_id
+
+    os.makedirs(BUNDLE_DIR, exist_ok=True)
+    # Ghi ra file tạm rồi đổi tên: không worker nào phục vụ một file đang ghi dở
+    fd, part_path = tempfile.mkstemp(dir=BUNDLE_DIR, suffix='.part')
+    os.close(fd)
+    if process_font_logic(font_file_path, part_path, title_file_path, art_file_path):
+        os.replace(part_path, final_path)
+        maybe_prune_bundles()
+        return bundle_id
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    return None
+
+# Mỗi bundle chứa nguyên Resources.mpk (vài trăm MB) nên BUNDLE_DIR phải được dọn thường xuyên
+BUNDLE_MAX_BYTES = int(os.environ.get('BUNDLE_MAX_BYTES', 10 * 1024 ** 3))
+BUNDLE_MAX_AGE_HOURS = float(os.environ.get('BUNDLE_MAX_AGE_HOURS', 24))
+BUNDLE_MIN_AGE_SECONDS = 600  # link vừa trả cho người dùng thì chưa xóa
+BUNDLE_PRUNE_INTERVAL = 60
+_last_bundle_prune = 0.0
+
+def _touch(path):
+    # mtime = lần dùng gần nhất (atime không tin được khi ổ đĩa mount noatime)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def prune_bundles(max_bytes=None, max_age_hours=None):
+    """
+    Xóa bundle lâu không dùng (quá max_age_hours), sau đó xóa bundle cũ nhất cho tới khi
+    BUNDLE_DIR dưới max_bytes. Bundle trong danh mục dựng sẵn không bao giờ bị xóa.
+    Trả về (số file đã xóa, số byte giải phóng).
+    """
+    max_bytes = BUNDLE_MAX_BYTES if max_bytes is None else max_bytes
+    max_age = (BUNDLE_MAX_AGE_HOURS if max_age_hours is None else max_age_hours) * 3600
+    keep = {entry.get('bundle_id') for entry in load_prebuilt_index()}
+    now = time.time()
+    try:
+        names = os.listdir(BUNDLE_DIR)
+    except OSError:
+        return 0, 0
+
+    candidates, stale_parts, total = [], [], 0
+    for name in names:
+        path = os.path.join(BUNDLE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if name.endswith('.zip'):
+            total += st.st_size
+            if name[:-4] not in keep:
+                candidates.append((st.st_mtime, st.st_size, path))
+        elif name.endswith('.part') and now - st.st_mtime > 3600:
+            # File ghi dở của worker bị kill giữa chừng
+            stale_parts.append((st.st_mtime, st.st_size, path))
+
+    removed, freed = 0, 0
+    for mtime, size, path in stale_parts + sorted(candidates):
+        age = now - mtime
+        if path.endswith('.zip'):
+            if age < BUNDLE_MIN_AGE_SECONDS or (age <= max_age and total <= max_bytes):
+                break
+            total -= size
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        removed += 1
+        freed += size
+    return removed, freed
+
+def maybe_prune_bundles():
+    """Dọn BUNDLE_DIR sau khi ghi bundle mới, tối đa 1 lần mỗi BUNDLE_PRUNE_INTERVAL giây mỗi process"""
+    global _last_bundle_prune
+    if time.time() - _last_bundle_prune < BUNDLE_PRUNE_INTERVAL:
+        return
+    _last_bundle_prune = time.time()
+    try:
+        prune_bundles()
+    except Exception as e:
+        print(f"Error in prune_bundles: {e}")
+
+@app.before_request
+def start_oidc_refresh():
+    # Mỗi worker một thread nền làm mới discovery/JWKS trước khi hết hạn
+    oidc_documents.start_background_refresh(GOOGLE_METADATA_URL)
+
+# Mỗi worker ghi số liệu pool của mình vào cache dùng chung, worker chết thì mục tự hết hạn
+POOL_METRICS_PUBLISH_INTERVAL = 10
+
+def publish_pool_metrics(snapshot):
+    shared_cache.set('pool_metrics', str(snapshot['pid']), snapshot,
+                     ttl=POOL_METRICS_PUBLISH_INTERVAL * 3, stale_ttl=0)
+
+@app.before_request
+def start_pool_metrics_publisher():
+    pool_metrics.start_publisher(publish_pool_metrics, POOL_METRICS_PUBLISH_INTERVAL)
+
+_assets_checked_pid = None
+
+@app.before_request
+def warm_assets_fingerprint():
+    # Request đầu tiên của mỗi worker: hash assets ở thread nền nếu stamp đã cũ (vd. sau deploy)
+    global _assets_checked_pid
+    if _assets_checked_pid != os.getpid():
+        _assets_checked_pid = os.getpid()
+        current_assets_fingerprint()
+
 # --- ROUTES CHÍNH ---
 @app.route('/tutorial')
 def tutorial():
     return render_template('tutorial.html')
 @app.route('/')
 def home():
-    versions = get_data()
+    versions = attach_deltas(get_data())
     return render_template('index.html', versions=versions)
 
 # --- AUTHENTICATION ---
@@ -291,6 +648,7 @@ def font_tool():
     
     return render_template('font_tool.html', 
                            guest_id=session['guest_session_id'],
+                           prebuilt_fonts=available_prebuilt(),
                            bank_acc="100872675193", # Số TK của bạn
                            bank_name="VietinBank")
 
@@ -313,37 +671,216 @@ def process_font():
         return redirect(url_for('font_tool'))
 
     # --- CHỈ DÀNH CHO THÀNH VIÊN ĐÃ ĐĂNG NHẬP ---
-    can_process = False
-    
-    # VIP donors can use unlimited times
+    # VIP donors can use unlimited times, regular members get 1 free trial
+    if not current_user.is_donor and current_user.free_trials <= 0:
+        flash('Bạn đã hết lượt dùng thử. Hãy trở thành Nhà tài trợ VIP để sử dụng không giới hạn!', 'warning')
+        return redirect(url_for('font_tool'))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, 'font.ttf')
+        file.save(input_path)
+        bundle_id = build_bundle(input_path)
+
+    if not bundle_id:
+        flash('Có lỗi xảy ra trong quá trình xử lý font.', 'danger')
+        return redirect(url_for('font_tool'))
+
+    # Chỉ trừ lượt khi đã đóng gói thành công
     if current_user.is_donor:
-        can_process = True
         flash('Xin chào Nhà tài trợ VIP! Font sẽ được xử lý ngay.', 'success')
-    # Regular members get 1 free trial
-    elif current_user.free_trials > 0:
+    else:
         current_user.free_trials -= 1
-        can_process = True
+        db.session.commit() # Lưu thay đổi số dư
         flash(f'Đã dùng 1 lượt miễn phí. Còn lại: {current_user.free_trials}', 'success')
+    # Tải qua URL cố định để trình duyệt có thể tải tiếp khi rớt mạng
+    return redirect(url_for('download_bundle', bundle_id=bundle_id))
+
+# --- API ĐÓNG GÓI BUNDLE (DÙNG CHO FONT TOOL) ---
+@app.route('/api/build-bundle', methods=['POST'])
+@login_required
+def build_bundle_api():
+    """Đóng gói bundle trên server, trả về link tải hỗ trợ Range/tải tiếp"""
+    file = request.files.get('font_file')
+    if not file or file.filename == '':
+        return jsonify({'success': False, 'message': 'Vui lòng chọn file font (.ttf)'}), 400
+
+    if not current_user.is_donor and current_user.free_trials <= 0:
+        return jsonify({'success': False, 'message': 'Bạn đã hết lượt dùng thử. Hãy trở thành Nhà tài trợ VIP để sử dụng không giới hạn!'}), 403
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, 'font.ttf')
+        file.save(input_path)
+        # Giữ cách đóng gói cũ của font tool: font người dùng dùng cho cả normal/title/art
+        bundle_id = build_bundle(input_path, input_path, input_path)
+
+    if not bundle_id:
+        return jsonify({'success': False, 'message': 'Có lỗi xảy ra trong quá trình xử lý font.'}), 500
+
+    # Chỉ trừ lượt khi đã đóng gói thành công
+    if not current_user.is_donor:
+        current_user.free_trials -= 1
+        db.session.commit()
+
+    return jsonify({
+        'success': True,
+        'download_url': url_for('download_bundle', bundle_id=bundle_id),
+        'size': os.path.getsize(bundle_path(bundle_id)),
+        'remaining_trials': current_user.free_trials,
+        'is_donor': current_user.is_donor
+    })
+
+# --- API DÙNG BUNDLE DỰNG SẴN (KHÔNG TỐN CPU ĐÓNG GÓI) ---
+@app.route('/api/use-prebuilt/<font_id>', methods=['POST'])
+@login_required
+def use_prebuilt_api(font_id):
+    entry = next((e for e in available_prebuilt() if e['id'] == font_id), None)
+    if not entry:
+        return jsonify({'success': False, 'message': 'Font dựng sẵn không tồn tại hoặc đang được cập nhật'}), 404
+
+    if not current_user.is_donor:
+        if current_user.free_trials <= 0:
+            return jsonify({'success': False, 'message': 'Bạn đã hết lượt dùng thử. Hãy trở thành Nhà tài trợ VIP để sử dụng không giới hạn!'}), 403
+        current_user.free_trials -= 1
+        db.session.commit()
+
+    return jsonify({
+        'success': True,
+        'download_url': url_for('download_bundle', bundle_id=entry['bundle_id']),
+        'size': entry['size'],
+        'sha256': entry['sha256'],
+        'remaining_trials': current_user.free_trials,
+        'is_donor': current_user.is_donor
+    })
+
+# --- API ĐÓNG GÓI NHIỀU BỘ FONT (CHỈ VIP) ---
+@app.route('/api/build-bundles', methods=['POST'])
+@login_required
+def build_bundles_api():
+    """
+    Đóng gói nhiều bộ font song song, trả kết quả từng bundle dạng NDJSON ngay khi xong.
+    - Trường 'sets' (JSON): [{"name": "Roboto", "normal": "<field>", "title": "<field>", "art": "<field>"}, ...]
+      trong đó <field> là tên trường file upload; title/art bỏ trống thì dùng font trong assets.
+    - Không có 'sets': mỗi file trong 'font_file' là một bộ riêng (chỉ normal.ttf).
+    """
+    if not current_user.is_donor:
+        return jsonify({'success': False, 'message': 'Đóng gói hàng loạt chỉ dành cho Nhà tài trợ VIP'}), 403
+
+    if request.form.get('sets'):
+        try:
+            sets = json.loads(request.form['sets'])
+        except ValueError:
+            sets = None
+        if not isinstance(sets, list) or not all(isinstance(item, dict) for item in sets):
+            return jsonify({'success': False, 'message': "Trường 'sets' không đúng định dạng"}), 400
     else:
-        flash('Bạn đã hết lượt dùng thử. Hãy trở thành Nhà tài trợ VIP để sử dụng không giới hạn!', 'warning')
-        return redirect(url_for('font_tool'))
+        sets = [{'name': f.filename, 'normal': f'font_file#{i}'} for i, f in enumerate(request.files.getlist('font_file'))]
 
-    if can_process:
-        db.session.commit() # Lưu thay đổi số dư
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, file.filename)
-            # Đổi tên file output thành WWM_VietHoa_Full.zip thay vì Patched_{filename}
-            output_path = os.path.join(temp_dir, "WWM_VietHoa_Full.zip")
-            file.save(input_path)
-            
-            if process_font_logic(input_path, output_path):
-                return send_file(output_path, as_attachment=True)
-            else:
-                flash('Có lỗi xảy ra trong quá trình xử lý font.', 'danger')
-                return redirect(url_for('font_tool'))
-    
-    return redirect(url_for('font_tool'))
+    if not sets:
+        return jsonify({'success': False, 'message': 'Vui lòng chọn ít nhất một file font (.ttf)'}), 400
+    if len(sets) > MAX_BATCH_SETS:
+        return jsonify({'success': False, 'message': f'Tối đa {MAX_BATCH_SETS} bộ font mỗi lần'}), 400
+
+    saved = {}
+    for i, f in enumerate(request.files.getlist('font_file')):
+        saved[f'font_file#{i}'] = f
+    for field in request.files:
+        if field != 'font_file':
+            saved[field] = request.files[field]
+    # Kiểm tra hết đầu vào trước khi ghi file nào ra đĩa
+    for item in sets:
+        name = item.get('name', '')
+        for role in FONT_ROLES:
+            field = item.get(role)
+            if field is None:
+                continue
+            if not isinstance(field, str):
+                return jsonify({'success': False, 'message': f'Tên trường file cho {role} của bộ "{name}" không hợp lệ'}), 400
+            if field and (field not in saved or saved[field].filename == ''):
+                return jsonify({'success': False, 'message': f'Thiếu file cho {role} của bộ "{name}"'}), 400
+        if not item.get('normal'):
+            return jsonify({'success': False, 'message': f'Bộ "{name}" thiếu font normal'}), 400
+
+    # Lưu mỗi file upload đúng 1 lần, các bộ font dùng chung file nếu trùng trường
+    temp_dir = tempfile.mkdtemp(prefix='wwm_batch_')
+    futures = {}
+    try:
+        paths = {}
+        for item in sets:
+            for role in FONT_ROLES:
+                field = item.get(role)
+                if field and field not in paths:
+                    paths[field] = os.path.join(temp_dir, f'{len(paths)}.ttf')
+                    saved[field].save(paths[field])
+
+        # Assets dùng chung cho cả lô: chỉ lấy dấu vân tay 1 lần
+        fingerprint = assets_fingerprint()
+        for i, item in enumerate(sets):
+            future = bundle_pool.submit(build_bundle, paths[item['normal']], paths.get(item.get('title')),
+                                        paths.get(item.get('art')), fingerprint)
+            futures[future] = (i, item)
+    finally:
+        # Thư mục tạm thuộc về các job: job cuối cùng xong (hoặc bị hủy) sẽ xóa,
+        # kể cả khi lưu file lỗi giữa chừng hay client ngắt kết nối
+        _remove_when_done(list(futures), temp_dir)
+
+    def generate():
+        try:
+            for future in as_completed(futures):
+                i, item = futures[future]
+                bundle_id = future.result()
+                result = {'index': i, 'name': item.get('name', f'set-{i + 1}'), 'success': bool(bundle_id)}
+                if bundle_id:
+                    result['download_url'] = url_for('download_bundle', bundle_id=bundle_id)
+                    result['size'] = os.path.getsize(bundle_path(bundle_id))
+                else:
+                    result['message'] = 'Có lỗi xảy ra trong quá trình xử lý font.'
+                yield json.dumps(result, ensure_ascii=False) + '\n'
+        finally:
+            # Client ngắt giữa chừng: bỏ các job chưa chạy, job đang chạy vẫn dùng được file tạm
+            for future in futures:
+                future.cancel()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# --- TẢI BUNDLE (HỖ TRỢ RANGE / IF-RANGE / ETAG) ---
+def _private_cache(resp):
+    # File tải về cần đăng nhập: chỉ trình duyệt được cache, proxy/CDN dùng chung thì không
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    return resp
+
+@app.route('/download/bundle/<bundle_id>')
+@login_required
+def download_bundle(bundle_id):
+    if not re.fullmatch(r'[0-9a-f]{64}', bundle_id):
+        abort(404)
+    path = bundle_path(bundle_id)
+    if not os.path.exists(path):
+        abort(404)
+    _touch(path)
+    # bundle_id là hash nội dung nên dùng luôn làm strong ETag;
+    # conditional=True để Werkzeug xử lý Range, If-Range, If-None-Match và Content-Length
+    resp = send_file(path, mimetype='application/zip', as_attachment=True,
+                     download_name=BUNDLE_NAME, conditional=True, etag=bundle_id,
+                     max_age=86400)
+    return _private_cache(resp)
+
+# --- TẢI BẢN CẬP NHẬT DELTA ---
+@app.route('/download/delta/<filename>')
+@login_required
+def download_delta(filename):
+    entry = next((m for m in mpk_delta.load_manifest(DELTA_DIR) if m.get('file') == filename), None)
+    if not entry:
+        abort(404)
+    resp = send_file(os.path.join(DELTA_DIR, entry['file']), mimetype='application/octet-stream',
+                     as_attachment=True, conditional=True, etag=entry['delta_sha256'], max_age=86400)
+    return _private_cache(resp)
+
+@app.route('/download/delta-tool')
+def download_delta_tool():
+    """Công cụ apply delta chạy offline trên máy người dùng"""
+    return send_file(os.path.join(os.path.dirname(__file__), 'mpk_delta.py'), mimetype='text/x-python',
+                     as_attachment=True, download_name='mpk_delta.py', conditional=True)
 
 # --- NẠP TIỀN CHO THÀNH VIÊN ---
 @app.route('/profile')
@@ -385,8 +922,7 @@ def handle_sepay_webhook():
             return jsonify({'success': False, 'message': 'Không có nội dung chuyển khoản'}), 400
 
         # 2. Tìm Mã đơn hàng (DH1234) trong nội dung description
-        import re
-        order_code_match = re.search(r'(DH\d+)', description)
+        order_code_match = ORDER_CODE_RE.search(description)
         if not order_code_match:
             # Nếu không tìm thấy mã đơn hàng, xử lý theo logic cũ
             return process_old_donation_logic(data)
@@ -418,7 +954,7 @@ def handle_sepay_webhook():
                 user.total_donated += real_amount
                 
                 # C. Set VIP (Nếu gói nạp có logic set VIP)
-                if real_amount >= 10000:  # Ví dụ nạp > 10k được VIP
+                if real_amount >= VIP_MIN_AMOUNT:  # Ví dụ nạp > 10k được VIP
                     user.is_donor = True
                 
                 # Tạo bản ghi donate để lưu lịch sử
@@ -429,6 +965,7 @@ def handle_sepay_webhook():
                 )
                 db.session.add(donation)
                 db.session.commit() # <--- Commit xong mới gửi mail để chắc chắn DB đã lưu
+                invalidate_leaderboard()
                 
                 # --- THÊM DÒNG NÀY ĐỂ GỬI MAIL ---
                 if user.email:
@@ -461,7 +998,7 @@ def process_old_donation_logic(data):
         
         # LOGIC 1: Xác thực donate từ user đã tồn tại
         # Format: WWM <user_id> <email_hash>
-        user_match = re.search(r'WWM\s+(\d+)\s+([a-f0-9]{32})', content, re.IGNORECASE)
+        user_match = WWM_USER_RE.search(content)
         if user_match:
             user_id = int(user_match.group(1))
             email_hash = user_match.group(2)
@@ -471,8 +1008,7 @@ def process_old_donation_logic(data):
                 expected_hash = hashlib.md5(user.email.lower().encode()).hexdigest()
                 if expected_hash == email_hash:
                     # Kiểm tra xem giao dịch này đã được xử lý chưa
-                    existing_donation = Donation.query.filter_by(transaction_id=transaction_id).first()
-                    if not existing_donation:
+                    if not donation_exists(transaction_id):
                         # Tạo bản ghi donate mới
                         donation = Donation(
                             user_id=user.id,
@@ -485,10 +1021,11 @@ def process_old_donation_logic(data):
                         user.total_donated += int(amount)
                         
                         # Set donor status nếu donate từ 10.000đ trở lên
-                        if user.total_donated >= 10000:
+                        if user.total_donated >= VIP_MIN_AMOUNT:
                             user.is_donor = True
                             
                         db.session.commit()
+                        invalidate_leaderboard()
                         # --- GỬI EMAIL CẢM ƠN ---
                         if user.email:
                             send_thank_you_email(user.email, user.username, int(amount), "OLD_DONATION")
@@ -499,7 +1036,7 @@ def process_old_donation_logic(data):
 
         # LOGIC 2: Xác thực donate từ user mới
         # Format: WWM NEW <email_hash>
-        new_user_match = re.search(r'WWM\s+NEW\s+([a-f0-9]{32})', content, re.IGNORECASE)
+        new_user_match = WWM_NEW_RE.search(content)
         if new_user_match:
             email_hash = new_user_match.group(1)
             # Tìm user theo email hash (nếu đã có trong hệ thống)
@@ -514,8 +1051,7 @@ def process_old_donation_logic(data):
         
             if matched_user:
                 # Kiểm tra xem giao dịch này đã được xử lý chưa
-                existing_donation = Donation.query.filter_by(transaction_id=transaction_id).first()
-                if not existing_donation:
+                if not donation_exists(transaction_id):
                     # Tạo bản ghi donate mới
                     donation = Donation(
                         user_id=matched_user.id,
@@ -528,10 +1064,11 @@ def process_old_donation_logic(data):
                     matched_user.total_donated += int(amount)
                     
                     # Set donor status nếu donate từ 10.000đ trở lên
-                    if matched_user.total_donated >= 10000:
+                    if matched_user.total_donated >= VIP_MIN_AMOUNT:
                         matched_user.is_donor = True
                         
                     db.session.commit()
+                    invalidate_leaderboard()
                     # --- GỬI EMAIL CẢM ƠN ---
                     if matched_user.email:
                         send_thank_you_email(matched_user.email, matched_user.username, int(amount), "OLD_DONATION")
@@ -702,33 +1239,52 @@ def generate_qr():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# --- API SỐ LIỆU CONNECTION POOL ---
+@app.route('/api/pool-metrics')
+def pool_metrics_api():
+    # Cùng kiểu xác thực với webhook SePay: Authorization: Apikey <METRICS_API_KEY>
+    expected_api_key = os.getenv('METRICS_API_KEY')
+    if not expected_api_key:
+        abort(404)
+    if request.headers.get('Authorization') != f'Apikey {expected_api_key}':
+        return jsonify({'success': False, 'message': 'Invalid API key'}), 401
+    # Mỗi worker có pool riêng: gộp số liệu các worker còn sống từ cache dùng chung
+    current = pool_metrics.snapshot()
+    publish_pool_metrics(current)
+    workers = sorted((snap for _, snap in shared_cache.items('pool_metrics')), key=lambda snap: snap['pid'])
+    return jsonify({'success': True, 'pool': current, 'workers': workers, 'totals': aggregate_snapshots(workers)})
+
 # --- API lấy top donor ---
+def load_top_donors():
+    """Truy vấn top 3 donor (kết quả được cache dùng chung giữa các worker)"""
+    # Lấy top 3 donor có tổng số tiền donate cao nhất
+    top_donors = User.query.filter(User.total_donated > 0)\
+                          .order_by(User.total_donated.desc())\
+                          .limit(3)\
+                          .all()
+    
+    # Format dữ liệu để trả về
+    donors_data = []
+    for i, user in enumerate(top_donors):
+        # Che dấu một phần email để bảo vệ privacy
+        email_parts = user.email.split('@')
+        if len(email_parts) == 2:
+            hidden_email = email_parts[0][:4] + '****@' + email_parts[1]
+        else:
+            hidden_email = '****@****'
+            
+        donors_data.append({
+            'rank': i + 1,
+            'email': hidden_email,
+            'total_donated': user.total_donated
+        })
+    return donors_data
+
 @app.route('/api/top-donors')
 def top_donors():
     """Lấy danh sách top donor để hiển thị trên trang chủ"""
     try:
-        # Lấy top 3 donor có tổng số tiền donate cao nhất
-        top_donors = User.query.filter(User.total_donated > 0)\
-                              .order_by(User.total_donated.desc())\
-                              .limit(3)\
-                              .all()
-        
-        # Format dữ liệu để trả về
-        donors_data = []
-        for i, user in enumerate(top_donors):
-            # Che dấu một phần email để bảo vệ privacy
-            email_parts = user.email.split('@')
-            if len(email_parts) == 2:
-                hidden_email = email_parts[0][:4] + '****@' + email_parts[1]
-            else:
-                hidden_email = '****@****'
-                
-            donors_data.append({
-                'rank': i + 1,
-                'email': hidden_email,
-                'total_donated': user.total_donated
-            })
-        
+        donors_data = shared_cache.get_or_refresh('leaderboard', 'top3', load_top_donors, LEADERBOARD_CACHE_TTL)
         return jsonify({
             'success': True,
             'top_donors': donors_data
@@ -739,45 +1295,49 @@ def top_donors():
 # Hàm tạo bảng tự động (chạy được cả trên Gunicorn/Render)
 # --- Thêm vào app.py (gần các route API khác) ---
 
+def load_donor_activity():
+    """Truy vấn Top Donate và Người vừa Donate (kết quả được cache dùng chung giữa các worker)"""
+    # 1. Lấy Top Donors (Dựa trên tổng tiền donate tích lũy)
+    top_users = User.query.filter(User.total_donated > 0)\
+                          .order_by(User.total_donated.desc())\
+                          .limit(5)\
+                          .all()
+    
+    top_data = []
+    for i, user in enumerate(top_users):
+        top_data.append({
+            'type': 'top',
+            'rank': i + 1,
+            'email': mask_email(user.email), # Hàm che email viết ở dưới
+            'amount': user.total_donated
+        })
+
+    # 2. Lấy Recent Donors (Người vừa donate - Dựa trên bảng Donation)
+    # Join bảng User và Donation để lấy email và thời gian
+    recent_donations = db.session.query(User.email, Donation.timestamp, Donation.amount)\
+        .join(Donation, User.id == Donation.user_id)\
+        .order_by(Donation.timestamp.desc())\
+        .limit(10)\
+        .all()
+        
+    recent_data = []
+    for email, timestamp, amount in recent_donations:
+        recent_data.append({
+            'type': 'new',
+            'email': mask_email(email),
+            'time': timestamp.isoformat()
+        })
+    return {'top': top_data, 'recent': recent_data}
+
 @app.route('/api/donor-activity')
 def donor_activity():
     """API lấy dữ liệu Top Donate và Người vừa Donate"""
     try:
-        # 1. Lấy Top Donors (Dựa trên tổng tiền donate tích lũy)
-        top_users = User.query.filter(User.total_donated > 0)\
-                              .order_by(User.total_donated.desc())\
-                              .limit(5)\
-                              .all()
-        
-        top_data = []
-        for i, user in enumerate(top_users):
-            top_data.append({
-                'type': 'top',
-                'rank': i + 1,
-                'email': mask_email(user.email), # Hàm che email viết ở dưới
-                'amount': user.total_donated
-            })
-
-        # 2. Lấy Recent Donors (Người vừa donate - Dựa trên bảng Donation)
-        # Join bảng User và Donation để lấy email và thời gian
-        recent_donations = db.session.query(User.email, Donation.timestamp, Donation.amount)\
-            .join(Donation, User.id == Donation.user_id)\
-            .order_by(Donation.timestamp.desc())\
-            .limit(10)\
-            .all()
-            
-        recent_data = []
-        for email, timestamp, amount in recent_donations:
-            recent_data.append({
-                'type': 'new',
-                'email': mask_email(email),
-                'time': timestamp.isoformat()
-            })
-
+        activity = shared_cache.get_or_refresh('leaderboard', 'activity', load_donor_activity, LEADERBOARD_CACHE_TTL)
         return jsonify({
             'success': True,
-            'top': top_data,
-            'recent': recent_data
+            'top': activity['top'],
+            'recent': activity['recent']
         })
 
     except Exception as e:
@@ -0,0 +1,93 @@
+"""
+Đóng gói sẵn bundle cho các font phổ biến (chạy offline trên server, sau mỗi lần đổi assets).
+
+Cách dùng:
+    python build_prebuilt.py prebuilt_fonts.json
+
+File manifest dạng:
+    [
+      {"id": "roboto", "name": "Roboto", "normal": "fonts/Roboto-Regular.ttf"},
+      {"id": "be-vietnam", "name": "Be Vietnam Pro", "normal": "fonts/BeVietnamPro.ttf", "title": "fonts/BeVietnamPro-Bold.ttf"}
+    ]
+Đường dẫn font tính theo thư mục chứa manifest; title/art bỏ trống thì dùng luôn font normal
+(giống bundle người dùng tự tải lên trong font tool).
+
+Kết quả ghi vào BUNDLE_DIR (cùng chỗ với bundle người dùng), danh mục PREBUILT_INDEX và
+assets_fingerprint.json (hash assets, cùng thư mục với PREBUILT_INDEX).
+Bundle đặt tên theo hash nội dung font + assets nên chỉ mục nào đổi font hoặc assets mới bị đóng gói lại.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+from app import (app, build_bundle, bundle_path, save_assets_stamp, assets_stamp_path, load_prebuilt_index,
+                 PREBUILT_INDEX, FONT_ROLES, _hash_file)
+
+
+def build_prebuilt(manifest_path, index_path=PREBUILT_INDEX):
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    previous = {entry['id']: entry for entry in load_prebuilt_index(index_path)}
+    # Hash assets 1 lần và lưu cạnh danh mục: web worker chỉ cần đọc lại, không phải hash Resources.mpk
+    fingerprint = save_assets_stamp(assets_stamp_path(index_path))
+
+    index, built, skipped, failed = [], 0, 0, 0
+    for item in manifest:
+        font_id = item['id']
+        paths = {role: os.path.join(base_dir, item[role]) for role in FONT_ROLES if item.get(role)}
+        missing = [p for p in paths.values() if not os.path.exists(p)]
+        if 'normal' not in paths or missing:
+            print(f"❌ {font_id}: thiếu file font {missing or 'normal'}")
+            failed += 1
+            continue
+
+        started = time.perf_counter()
+        bundle_id = build_bundle(paths['normal'], paths.get('title', paths['normal']),
+                                 paths.get('art', paths['normal']), fingerprint)
+        if not bundle_id:
+            print(f"❌ {font_id}: lỗi đóng gói")
+            failed += 1
+            continue
+
+        old = previous.get(font_id)
+        if old and old.get('bundle_id') == bundle_id and os.path.exists(bundle_path(bundle_id)):
+            entry = dict(old, name=item.get('name', font_id))
+            skipped += 1
+            print(f"= {font_id}: không đổi")
+        else:
+            entry = {
+                'id': font_id,
+                'name': item.get('name', font_id),
+                'bundle_id': bundle_id,
+                # Hash của chính file ZIP để người dùng kiểm tra sau khi tải
+                'sha256': _hash_file(bundle_path(bundle_id), hashlib.sha256()).hexdigest(),
+                'size': os.path.getsize(bundle_path(bundle_id)),
+                'assets': fingerprint,
+                'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            }
+            built += 1
+            print(f"+ {font_id}: đóng gói trong {time.perf_counter() - started:.2f}s")
+        index.append(entry)
+
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(index_path + '.tmp', index_path)
+    print(f"Xong: {built} đóng gói mới, {skipped} giữ nguyên, {failed} lỗi -> {index_path}")
+    return failed == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Đóng gói sẵn bundle cho font phổ biến')
+    parser.add_argument('manifest', help='File JSON danh sách font')
+    parser.add_argument('--index', default=PREBUILT_INDEX, help='Nơi ghi danh mục bundle dựng sẵn')
+    args = parser.parse_args(argv)
+    with app.app_context():
+        return 0 if build_prebuilt(args.manifest, args.index) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Cấu hình connection pool SQLAlchemy từ biến môi trường và thu thập số liệu pool.
+
+Biến môi trường:
+    DB_POOL_SIZE        (mặc định 5)    số kết nối giữ sẵn
+    DB_MAX_OVERFLOW     (mặc định 5)    số kết nối mở thêm khi cao điểm
+    DB_POOL_TIMEOUT     (mặc định 10)   số giây chờ kết nối trống trước khi báo lỗi
+    DB_POOL_RECYCLE     (mặc định 280)  đóng kết nối cũ hơn N giây (thấp hơn idle timeout của Postgres hosted)
+    DB_POOL_PRE_PING    (mặc định 1)    kiểm tra kết nối trước khi dùng, tự mở lại nếu đã bị server đóng
+    DB_PGBOUNCER        (mặc định 0)    chạy sau PgBouncer (transaction pooling): tắt prepared statement phía server
+
+Load test:
+    python db_pool.py bench --threads 32 --requests 200
+"""
+import os
+import sys
+import time
+import threading
+import argparse
+from collections import deque
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+def _env_bool(name, default):
+    return os.environ.get(name, default).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class PoolMetrics:
+    """Số liệu pool của process hiện tại: thời gian chờ checkout, overflow, invalidate, timeout"""
+
+    def __init__(self, window=2000):
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.connects = 0
+        self.max_overflow_seen = 0
+        self.engine = None
+        self.started_at = time.time()
+        self._publisher_pid = None
+        self._publisher_lock = threading.Lock()
+
+    def record_wait(self, seconds, pool):
+        overflow = pool.overflow()
+        with self._lock:
+            self._waits.append(seconds)
+            self.checkouts += 1
+            self.max_overflow_seen = max(self.max_overflow_seen, overflow)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_invalidation(self, soft=False):
+        with self._lock:
+            if soft:
+                self.soft_invalidations += 1
+            else:
+                self.invalidations += 1
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def reset(self):
+        with self._lock:
+            self._waits.clear()
+            self.checkouts = self.timeouts = self.invalidations = self.soft_invalidations = self.connects = 0
+            self.max_overflow_seen = 0
+
+    def snapshot(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            counters = {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'invalidations': self.invalidations,
+                'soft_invalidations': self.soft_invalidations,
+                'connects': self.connects,
+                'max_overflow_seen': self.max_overflow_seen,
+            }
+
+        def pct(p):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 3)
+
+        # Đọc engine.pool mỗi lần: engine.dispose() thay pool mới
+        pool = self.engine.pool if self.engine is not None else None
+        if not isinstance(pool, QueuePool):
+            pool = None
+        return {
+            # Số liệu chỉ của worker này (mỗi worker gunicorn một pool riêng)
+            'pid': os.getpid(),
+            'uptime_s': round(time.time() - self.started_at, 1),
+            'checkout_wait_ms': {'p50': pct(0.50), 'p95': pct(0.95), 'p99': pct(0.99),
+                                 'max': round(waits[-1] * 1000, 3) if waits else 0.0},
+            **counters,
+            'pool_size': pool.size() if pool is not None else None,
+            'checked_out': pool.checkedout() if pool is not None else None,
+            'overflow': pool.overflow() if pool is not None else None,
+        }
+
+    def start_publisher(self, publish, interval=10):
+        """Thread nền gọi publish(snapshot) định kỳ (1 thread mỗi process, gọi lại sau khi fork vẫn an toàn)"""
+        if self._publisher_pid == os.getpid():
+            return
+        with self._publisher_lock:
+            if self._publisher_pid == os.getpid():
+                return
+            self._publisher_pid = os.getpid()
+
+            def loop():
+                while True:
+                    try:
+                        publish(self.snapshot())
+                    except Exception as e:
+                        print(f"Pool metrics: không ghi được số liệu: {e}")
+                    time.sleep(interval)
+
+            threading.Thread(target=loop, name='pool-metrics', daemon=True).start()
+
+
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool đo thời gian lấy kết nối (gồm cả chờ slot trống và mở kết nối mới)"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record_timeout()
+            raise
+        pool_metrics.record_wait(time.perf_counter() - started, self)
+        return conn
+
+
+def engine_options_from_env(database_url):
+    """Tạo SQLALCHEMY_ENGINE_OPTIONS cho Flask-SQLAlchemy"""
+    if database_url.startswith('sqlite') and (':memory:' in database_url or database_url.rstrip('/') == 'sqlite:'):
+        return {}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 280)),
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', '1'),
+    }
+    if _env_bool('DB_PGBOUNCER', '0'):
+        # PgBouncer transaction pooling không giữ prepared statement giữa các transaction.
+        # psycopg2 không dùng prepared statement phía server nên không cần chỉnh;
+        # psycopg 3 thì phải tắt tự động prepare.
+        if database_url.startswith('postgresql+psycopg:') or database_url.startswith('postgresql+psycopg3:'):
+            options['connect_args'] = {'prepare_threshold': None}
+    return options
+
+
+def install_pool_metrics(engine):
+    """Gắn event đếm invalidate/connect vào engine và lưu engine để đọc số liệu pool"""
+    pool_metrics.engine = engine
+
+    @event.listens_for(engine, 'invalidate')
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        pool_metrics.record_invalidation()
+
+    @event.listens_for(engine, 'soft_invalidate')
+    def _on_soft_invalidate(dbapi_connection, connection_record, exception):
+        pool_metrics.record_invalidation(soft=True)
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        pool_metrics.record_connect()
+
+    return pool_metrics
+
+
+SUMMED_COUNTERS = ('checkouts', 'timeouts', 'invalidations', 'soft_invalidations', 'connects', 'checked_out', 'overflow')
+
+
+def aggregate_snapshots(snapshots):
+    """Cộng dồn bộ đếm của các worker (percentile không cộng được nên giữ theo từng worker)"""
+    totals = {name: sum(s.get(name) or 0 for s in snapshots) for name in SUMMED_COUNTERS}
+    totals['workers'] = len(snapshots)
+    totals['max_checkout_wait_ms'] = max((s['checkout_wait_ms']['max'] for s in snapshots), default=0.0)
+    totals['max_overflow_seen'] = max((s['max_overflow_seen'] for s in snapshots), default=0)
+    return totals
+
+
+def bench(database_url, threads, requests_per_thread, hold_ms):
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(database_url, **engine_options_from_env(database_url))
+    install_pool_metrics(engine)
+    pool_metrics.reset()
+    errors = []
+
+    def worker():
+        for _ in range(requests_per_thread):
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text('SELECT 1'))
+                    # Giả lập thời gian xử lý request khi đang giữ kết nối
+                    time.sleep(hold_ms / 1000)
+            except exc.TimeoutError as e:
+                errors.append(e)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+
+    snap = pool_metrics.snapshot()
+    waits = snap['checkout_wait_ms']
+    print(f"{threads} thread x {requests_per_thread} request, giữ kết nối {hold_ms}ms, "
+          f"pool_size={engine.pool.size()} max_overflow={engine.pool._max_overflow}")
+    print(f"  checkout p50 {waits['p50']}ms  p95 {waits['p95']}ms  p99 {waits['p99']}ms  max {waits['max']}ms")
+    print(f"  overflow cao nhất {snap['max_overflow_seen']}, kết nối mở {snap['connects']}, "
+          f"timeout {snap['timeouts']}, {snap['checkouts'] / elapsed:,.0f} checkout/s")
+    engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test connection pool')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('bench')
+    p.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///pool_bench.db'))
+    p.add_argument('--threads', type=int, default=32)
+    p.add_argument('--requests', type=int, default=200)
+    p.add_argument('--hold-ms', type=float, default=5)
+    args = parser.parse_args(argv)
+    url = args.database_url.replace('postgres://', 'postgresql://', 1)
+    bench(url, args.threads, args.requests, args.hold_ms)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
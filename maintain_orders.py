@@ -0,0 +1,133 @@
+"""
+Dọn dẹp bảng giao dịch, chạy định kỳ (cron / Render Cron Job).
+
+Cách dùng:
+    python maintain_orders.py expire            # PENDING quá hạn -> EXPIRED
+    python maintain_orders.py archive           # chuyển Transaction/Donation cũ sang bảng archive
+    python maintain_orders.py bundles           # dọn bundle cũ trong BUNDLE_DIR (trừ bundle dựng sẵn)
+    python maintain_orders.py all
+
+Cấu hình qua biến môi trường (hoặc tham số dòng lệnh):
+    PENDING_ORDER_TTL_HOURS  (mặc định 24)   đơn PENDING cũ hơn mức này sẽ hết hạn
+    ARCHIVE_AFTER_DAYS       (mặc định 180)  giao dịch đã xong cũ hơn mức này được lưu trữ
+    MAINTENANCE_BATCH_SIZE   (mặc định 1000) số dòng mỗi lô, mỗi lô commit riêng
+    BUNDLE_MAX_AGE_HOURS     (mặc định 24)   bundle không được tải lại lâu hơn mức này sẽ bị xóa
+    BUNDLE_MAX_BYTES         (mặc định 10GB) dung lượng tối đa của BUNDLE_DIR
+
+Đơn EXPIRED vẫn được webhook cộng tiền nếu người dùng chuyển khoản muộn.
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, update, delete, literal, DateTime
+
+from app import (app, db, Transaction, Donation, TransactionArchive, DonationArchive,
+                 transaction_status_created_index, prune_bundles, BUNDLE_MAX_BYTES, BUNDLE_MAX_AGE_HOURS)
+
+PENDING_ORDER_TTL_HOURS = float(os.environ.get('PENDING_ORDER_TTL_HOURS', 24))
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+BATCH_SIZE = int(os.environ.get('MAINTENANCE_BATCH_SIZE', 1000))
+FINISHED_STATUSES = ('SUCCESS', 'EXPIRED', 'CANCELLED')
+
+
+def _report(name, count, started):
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed > 0 else 0
+    print(f"{name}: {count} dòng trong {elapsed:.2f}s ({rate:,.0f} dòng/s)")
+
+
+def expire_pending_orders(ttl_hours=PENDING_ORDER_TTL_HOURS, batch_size=BATCH_SIZE):
+    """Chuyển các đơn PENDING quá ttl_hours sang EXPIRED theo từng lô, trả về số dòng"""
+    t = Transaction.__table__
+    cutoff = datetime.utcnow() - timedelta(hours=ttl_hours)
+    total = 0
+    while True:
+        ids = db.session.execute(
+            select(t.c.id).where(t.c.status == 'PENDING', t.c.created_at < cutoff).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        # Điều kiện status lặp lại để không ghi đè đơn vừa được webhook chuyển SUCCESS
+        result = db.session.execute(
+            update(t).where(t.c.id.in_(ids), t.c.status == 'PENDING')
+            .values(status='EXPIRED', updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+        total += result.rowcount
+    return total
+
+
+def _move_rows(source, archive, condition, batch_size):
+    """Copy từng lô sang bảng archive rồi xóa khỏi bảng chính trong cùng một transaction"""
+    columns = [c.name for c in source.columns]
+    total = 0
+    while True:
+        ids = db.session.execute(
+            select(source.c.id).where(condition).order_by(source.c.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        archived_at = literal(datetime.utcnow(), DateTime)
+        try:
+            db.session.execute(
+                insert(archive).from_select(
+                    columns + ['archived_at'],
+                    select(*[source.c[name] for name in columns], archived_at).where(source.c.id.in_(ids))
+                )
+            )
+            db.session.execute(delete(source).where(source.c.id.in_(ids)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        total += len(ids)
+    return total
+
+
+def archive_history(after_days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE):
+    """Lưu trữ Transaction đã xong và Donation cũ hơn after_days, trả về (số transaction, số donation)"""
+    cutoff = datetime.utcnow() - timedelta(days=after_days)
+    t, d = Transaction.__table__, Donation.__table__
+    moved_transactions = _move_rows(
+        t, TransactionArchive.__table__,
+        (t.c.status.in_(FINISHED_STATUSES)) & (t.c.created_at < cutoff), batch_size)
+    moved_donations = _move_rows(d, DonationArchive.__table__, d.c.timestamp < cutoff, batch_size)
+    return moved_transactions, moved_donations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hết hạn đơn PENDING và lưu trữ lịch sử giao dịch')
+    parser.add_argument('job', choices=('expire', 'archive', 'bundles', 'all'))
+    parser.add_argument('--ttl-hours', type=float, default=PENDING_ORDER_TTL_HOURS)
+    parser.add_argument('--archive-days', type=float, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--bundle-max-age-hours', type=float, default=BUNDLE_MAX_AGE_HOURS)
+    parser.add_argument('--bundle-max-bytes', type=int, default=BUNDLE_MAX_BYTES)
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        transaction_status_created_index.create(db.engine, checkfirst=True)
+
+        if args.job in ('expire', 'all'):
+            started = time.perf_counter()
+            _report('Đơn PENDING hết hạn', expire_pending_orders(args.ttl_hours, args.batch_size), started)
+
+        if args.job in ('archive', 'all'):
+            started = time.perf_counter()
+            moved_transactions, moved_donations = archive_history(args.archive_days, args.batch_size)
+            _report('Lưu trữ Transaction + Donation', moved_transactions + moved_donations, started)
+            print(f"  Transaction: {moved_transactions}, Donation: {moved_donations}")
+
+        if args.job in ('bundles', 'all'):
+            started = time.perf_counter()
+            removed, freed = prune_bundles(args.bundle_max_bytes, args.bundle_max_age_hours)
+            _report('Dọn bundle', removed, started)
+            print(f"  Giải phóng {freed / 1024 ** 2:,.1f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
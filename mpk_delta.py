@@ -0,0 +1,403 @@
+"""
+Delta nhị phân theo block giữa hai phiên bản Resources.mpk.
+
+Cách dùng:
+    python mpk_delta.py build  <old.mpk> <new.mpk> --out deltas --from-version v1 --to-version v2
+    python mpk_delta.py apply  <old.mpk> <patch.wdelta> <new.mpk>
+    python mpk_delta.py bench  --size-mb 300 --changes 20
+
+File delta chỉ chứa các đoạn mới (nén zlib) và lệnh COPY tham chiếu tới
+block đã có trong file cũ. Block cũ được tìm ở mọi offset của file mới bằng
+checksum cuộn kiểu rsync, nên chèn/xóa làm lệch dữ liệu phía sau vẫn dùng lại được. Lúc apply kiểm tra sha256 của file cũ trước và
+của file mới sau khi ghi xong, sai hash thì không ghi đè file nào cả.
+File này không phụ thuộc Flask, người dùng có thể tải về và chạy riêng.
+"""
+import os
+import sys
+import json
+import time
+import struct
+import hashlib
+import argparse
+import tempfile
+import zlib
+
+MAGIC = b'WWMDELTA1'
+DEFAULT_BLOCK_SIZE = 16 * 1024
+MAX_BLOCK_SIZE = 64 * 1024  # a (tổng byte) phải vừa 24 bit của checksum cuộn
+READ_CHUNK = 1024 * 1024
+SEGMENT = 8 * 1024 * 1024   # số vị trí tính checksum cuộn mỗi lượt numpy
+LITERAL_CHUNK = 1024 * 1024
+WEAK_MASK_A = (1 << 24) - 1
+WEAK_MASK_B = (1 << 40) - 1
+
+# Header: magic | block_size | old_size | new_size | old_sha256 | new_sha256
+HEADER = struct.Struct('<9sIQQ32s32s')
+OP_COPY = b'C'     # u64 old_offset, u64 length
+OP_LITERAL = b'L'  # u32 raw_len, u32 comp_len, <comp bytes>
+OP_END = b'E'
+COPY_ARGS = struct.Struct('<QQ')
+LITERAL_ARGS = struct.Struct('<II')
+
+
+class DeltaError(Exception):
+    pass
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+def _weak_hashes(np, data, block_size):
+    """
+    Checksum cuộn kiểu rsync cho mọi cửa sổ block_size byte trong data (mảng uint8):
+    a = tổng các byte, b = tổng có trọng số (block_size..1). Tính bằng cumsum nên không cần lặp từng byte.
+    """
+    x = data.astype(np.int64)
+    count = len(x) - block_size + 1
+    s1 = np.concatenate(([0], np.cumsum(x)))
+    s2 = np.concatenate(([0], np.cumsum(np.arange(len(x), dtype=np.int64) * x)))
+    a = s1[block_size:] - s1[:count]
+    start = np.arange(count, dtype=np.int64)
+    b = (start + block_size) * a - (s2[block_size:] - s2[:count])
+    return _combine(np, a, b)
+
+
+def _combine(np, a, b):
+    return ((b.astype(np.uint64) & WEAK_MASK_B) << np.uint64(24)) | (a.astype(np.uint64) & WEAK_MASK_A)
+
+
+def _strong_hash(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def _index_blocks(np, path, block_size):
+    """Map checksum cuộn -> {strong hash: offset} cho các block đủ block_size byte của file cũ"""
+    index = {}
+    data = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+    weights = np.arange(block_size, 0, -1, dtype=np.int64)
+    per_chunk = max(1, READ_CHUNK // block_size)
+    for first in range(0, len(data) // block_size, per_chunk):
+        chunk = data[first * block_size:(first + per_chunk) * block_size]
+        blocks = chunk[:len(chunk) // block_size * block_size].reshape(-1, block_size)
+        # Cùng công thức với _weak_hashes, tính thẳng cho các block nằm đúng bội số block_size
+        wide = blocks.astype(np.int64)
+        for i, weak in enumerate(_combine(np, wide.sum(axis=1), wide @ weights).tolist()):
+            offset = (first + i) * block_size
+            index.setdefault(weak, {}).setdefault(_strong_hash(blocks[i].tobytes()), offset)
+    return index
+
+
+def _candidates(np, data, block_size, weak_keys):
+    """Các vị trí (mọi offset, không chỉ bội số block) trong file mới có checksum cuộn trùng block cũ"""
+    positions, weaks = [], []
+    weak_keys = np.sort(weak_keys)
+    total = len(data) - block_size + 1
+    for seg_start in range(0, max(total, 0), SEGMENT):
+        seg = data[seg_start:seg_start + SEGMENT + block_size - 1]
+        weak = _weak_hashes(np, seg, block_size)
+        if not len(weak_keys):
+            break
+        # Tra bảng đã sắp xếp bằng searchsorted, nhanh hơn np.isin (không phải sort cả đoạn)
+        slot = np.minimum(np.searchsorted(weak_keys, weak), len(weak_keys) - 1)
+        hits = np.flatnonzero(weak_keys[slot] == weak)
+        positions.append(hits + seg_start)
+        weaks.append(weak[hits])
+    if not positions:
+        return np.zeros(0, np.int64), np.zeros(0, np.uint64)
+    return np.concatenate(positions), np.concatenate(weaks)
+
+
+def make_delta(old_path, new_path, delta_path, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Tạo file delta từ old_path -> new_path, trả về dict thống kê.
+    Block của file cũ được tìm ở mọi offset trong file mới (checksum cuộn + blake2b),
+    nên chuỗi dịch bị dài/ngắn đi chỉ làm mất vài block quanh chỗ sửa, không phải cả phần sau.
+    """
+    # numpy chỉ cần khi tạo delta trên server (đã có sẵn qua pandas); apply_delta chỉ dùng thư viện chuẩn
+    import numpy as np
+
+    if not 1 <= block_size <= MAX_BLOCK_SIZE:
+        raise DeltaError(f'block_size phải trong khoảng 1..{MAX_BLOCK_SIZE}')
+    index = _index_blocks(np, old_path, block_size)
+    old_sha = sha256_file(old_path)
+    new_sha = sha256_file(new_path)
+    stats = {'copied_bytes': 0, 'literal_bytes': 0}
+    new_size = os.path.getsize(new_path)
+    data = np.memmap(new_path, dtype=np.uint8, mode='r') if new_size else np.zeros(0, np.uint8)
+    positions, weaks = _candidates(np, data, block_size, np.fromiter(index.keys(), np.uint64, len(index)))
+
+    with open(delta_path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, block_size, os.path.getsize(old_path), new_size, old_sha, new_sha))
+
+        # Gộp các block COPY liền nhau để giảm số lệnh
+        copy_start, copy_len = None, 0
+
+        def flush_copy():
+            nonlocal copy_start, copy_len
+            if copy_len:
+                out.write(OP_COPY + COPY_ARGS.pack(copy_start, copy_len))
+                stats['copied_bytes'] += copy_len
+            copy_start, copy_len = None, 0
+
+        def write_literal(start, end):
+            for i in range(start, end, LITERAL_CHUNK):
+                raw = data[i:min(end, i + LITERAL_CHUNK)].tobytes()
+                comp = zlib.compress(raw, 6)
+                out.write(OP_LITERAL + LITERAL_ARGS.pack(len(raw), len(comp)) + comp)
+                stats['literal_bytes'] += len(raw)
+
+        pos, ci = 0, 0
+        while ci < len(positions):
+            cand = int(positions[ci])
+            if cand < pos:
+                # Bỏ qua các ứng viên nằm trong block vừa khớp
+                ci = int(np.searchsorted(positions, pos))
+                continue
+            old_offset = index[int(weaks[ci])].get(_strong_hash(data[cand:cand + block_size].tobytes()))
+            if old_offset is None:
+                ci += 1
+                continue
+            if cand > pos:
+                flush_copy()
+                write_literal(pos, cand)
+            if copy_len and copy_start + copy_len == old_offset:
+                copy_len += block_size
+            else:
+                flush_copy()
+                copy_start, copy_len = old_offset, block_size
+            pos = cand + block_size
+        flush_copy()
+        write_literal(pos, new_size)
+        out.write(OP_END)
+
+    stats['delta_bytes'] = os.path.getsize(delta_path)
+    stats['old_sha256'] = old_sha.hex()
+    stats['new_sha256'] = new_sha.hex()
+    return stats
+
+
+def read_header(delta_path):
+    with open(delta_path, 'rb') as f:
+        raw = f.read(HEADER.size)
+    if len(raw) != HEADER.size:
+        raise DeltaError('File delta bị cắt ngắn')
+    magic, block_size, old_size, new_size, old_sha, new_sha = HEADER.unpack(raw)
+    if magic != MAGIC:
+        raise DeltaError('Không phải file delta WWM')
+    return {'block_size': block_size, 'old_size': old_size, 'new_size': new_size,
+            'old_sha256': old_sha.hex(), 'new_sha256': new_sha.hex()}
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise DeltaError('File delta bị hỏng hoặc bị cắt ngắn')
+    return data
+
+
+def apply_delta(old_path, delta_path, out_path):
+    """Áp dụng delta lên old_path, ghi kết quả ra out_path sau khi kiểm tra hash"""
+    header = read_header(delta_path)
+    if os.path.getsize(old_path) != header['old_size'] or sha256_file(old_path).hex() != header['old_sha256']:
+        raise DeltaError('File Resources.mpk hiện tại không khớp phiên bản gốc của bản cập nhật')
+
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    fd, part_path = tempfile.mkstemp(dir=out_dir, suffix='.part')
+    new_sha = hashlib.sha256()
+    try:
+        with open(delta_path, 'rb') as delta, open(old_path, 'rb') as old, os.fdopen(fd, 'wb') as out:
+            delta.seek(HEADER.size)
+            while True:
+                op = delta.read(1)
+                if op == OP_END:
+                    break
+                if op == OP_COPY:
+                    offset, length = COPY_ARGS.unpack(_read_exact(delta, COPY_ARGS.size))
+                    old.seek(offset)
+                    while length:
+                        chunk = old.read(min(length, READ_CHUNK))
+                        if not chunk:
+                            raise DeltaError('Lệnh COPY vượt quá kích thước file cũ')
+                        new_sha.update(chunk)
+                        out.write(chunk)
+                        length -= len(chunk)
+                elif op == OP_LITERAL:
+                    raw_len, comp_len = LITERAL_ARGS.unpack(_read_exact(delta, LITERAL_ARGS.size))
+                    try:
+                        chunk = zlib.decompress(_read_exact(delta, comp_len))
+                    except zlib.error as e:
+                        raise DeltaError(f'Dữ liệu LITERAL bị hỏng: {e}')
+                    if len(chunk) != raw_len:
+                        raise DeltaError('Dữ liệu LITERAL bị hỏng')
+                    new_sha.update(chunk)
+                    out.write(chunk)
+                else:
+                    raise DeltaError('File delta bị hỏng hoặc bị cắt ngắn')
+
+        if new_sha.hexdigest() != header['new_sha256']:
+            raise DeltaError('Hash file sau khi cập nhật không đúng')
+        os.replace(part_path, out_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return header
+
+
+def publish_delta(old_path, new_path, out_dir, from_version, to_version, block_size=DEFAULT_BLOCK_SIZE):
+    """Tạo delta và ghi thông tin vào <out_dir>/manifest.json để web hiển thị cạnh phiên bản"""
+    os.makedirs(out_dir, exist_ok=True)
+    name = f"Resources_{_slug(from_version)}_to_{_slug(to_version)}.wdelta"
+    stats = make_delta(old_path, new_path, os.path.join(out_dir, name), block_size)
+
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    manifest = load_manifest(out_dir)
+    manifest = [m for m in manifest if m.get('file') != name]
+    manifest.append({
+        'file': name,
+        'from_version': from_version,
+        'to_version': to_version,
+        'old_sha256': stats['old_sha256'],
+        'new_sha256': stats['new_sha256'],
+        'delta_sha256': sha256_file(os.path.join(out_dir, name)).hex(),
+        'delta_size': stats['delta_bytes'],
+        'full_size': os.path.getsize(new_path),
+    })
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest[-1]
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _slug(text):
+    return ''.join(c if c.isalnum() or c in '.-' else '_' for c in str(text).strip())
+
+
+def _write_random(path, size, rng):
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            n = min(remaining, READ_CHUNK)
+            f.write(rng.randbytes(n))
+            remaining -= n
+
+
+def _synthetic_versions(workdir, size, changes, block_size, scenario):
+    """
+    Sinh 2 file giả lập MPK:
+    - overwrite: sửa vài vùng nhỏ rải rác (giữ nguyên độ dài) + thêm dữ liệu ở cuối
+    - shift: thay chuỗi bằng chuỗi dài/ngắn hơn ở vài chỗ rải rác, mọi dữ liệu phía sau bị lệch
+    """
+    import random
+    rng = random.Random(2024)
+    old_path = os.path.join(workdir, 'old.mpk')
+    new_path = os.path.join(workdir, 'new.mpk')
+    _write_random(old_path, size, rng)
+
+    # Các điểm sửa theo thứ tự tăng dần: (offset, số byte bị thay, dữ liệu mới)
+    edits = []
+    for offset in sorted(rng.sample(range(size - 512), changes)):
+        old_len = rng.randrange(16, 256)
+        new_len = old_len if scenario == 'overwrite' else max(1, old_len + rng.randrange(-64, 65))
+        edits.append((offset, old_len, rng.randbytes(new_len)))
+
+    with open(old_path, 'rb') as src, open(new_path, 'wb') as dst:
+        pos = 0
+        for offset, old_len, data in edits:
+            if offset < pos:
+                continue
+            dst.write(src.read(offset - pos))
+            dst.write(data)
+            src.seek(old_len, os.SEEK_CUR)
+            pos = offset + old_len
+        for chunk in iter(lambda: src.read(READ_CHUNK), b''):
+            dst.write(chunk)
+        if scenario == 'overwrite':
+            dst.write(rng.randbytes(block_size * 2))
+    return old_path, new_path
+
+
+def bench(size_mb, changes, block_size, mbps, scenarios=('overwrite', 'shift')):
+    for scenario in scenarios:
+        with tempfile.TemporaryDirectory() as workdir:
+            old_path, new_path = _synthetic_versions(workdir, size_mb * 1024 * 1024, changes, block_size, scenario)
+            delta_path = os.path.join(workdir, 'patch.wdelta')
+            out_path = os.path.join(workdir, 'out.mpk')
+
+            t0 = time.perf_counter()
+            stats = make_delta(old_path, new_path, delta_path, block_size)
+            build_s = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            apply_delta(old_path, delta_path, out_path)
+            apply_s = time.perf_counter() - t0
+
+            full = os.path.getsize(new_path)
+            delta = stats['delta_bytes']
+            bytes_per_s = mbps * 1000 * 1000 / 8
+            print(f"[{scenario}] {changes} chỗ sửa, block {block_size // 1024} KB")
+            print(f"File mới:        {full / 1e6:10.1f} MB")
+            print(f"Delta:           {delta / 1e6:10.3f} MB ({delta / full * 100:.3f}% file đầy đủ)")
+            print(f"Tạo delta:       {build_s:10.2f} s (offline)")
+            print(f"Apply delta:     {apply_s:10.2f} s")
+            print(f"Tải đầy đủ @{mbps} Mbps: {full / bytes_per_s:8.1f} s")
+            print(f"Tải delta + apply @{mbps} Mbps: {delta / bytes_per_s + apply_s:6.1f} s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Delta nhị phân cho Resources.mpk')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p = sub.add_parser('build', help='Tạo delta giữa 2 phiên bản và cập nhật manifest.json')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('--out', default=os.environ.get('DELTA_DIR', 'deltas'))
+    p.add_argument('--from-version', required=True)
+    p.add_argument('--to-version', required=True)
+    p.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+
+    p = sub.add_parser('apply', help='Áp dụng delta lên Resources.mpk hiện có')
+    p.add_argument('old')
+    p.add_argument('delta')
+    p.add_argument('out')
+
+    p = sub.add_parser('bench', help='So sánh delta với tải đầy đủ trên file giả lập')
+    p.add_argument('--size-mb', type=int, default=300)
+    p.add_argument('--changes', type=int, default=20)
+    p.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+    p.add_argument('--mbps', type=float, default=50)
+    p.add_argument('--scenario', choices=('overwrite', 'shift', 'all'), default='all',
+                   help='overwrite: sửa giữ nguyên độ dài; shift: chèn/xóa làm lệch dữ liệu phía sau')
+
+    args = parser.parse_args(argv)
+    try:
+        if args.cmd == 'build':
+            entry = publish_delta(args.old, args.new, args.out, args.from_version, args.to_version, args.block_size)
+            print(json.dumps(entry, ensure_ascii=False, indent=2))
+        elif args.cmd == 'apply':
+            apply_delta(args.old, args.delta, args.out)
+            print(f"✅ Đã cập nhật: {args.out}")
+        else:
+            scenarios = ('overwrite', 'shift') if args.scenario == 'all' else (args.scenario,)
+            bench(args.size_mb, args.changes, args.block_size, args.mbps, scenarios)
+    except DeltaError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Cache tài liệu OpenID discovery và JWKS (Google login) trên đĩa, dùng chung giữa các worker.
+
+- Lưu trong SharedCache (SQLite), worker mới khởi động đọc luôn bản đã có, không phải gọi Google
+- Thời gian còn mới lấy theo header Cache-Control: max-age của chính tài liệu
+- Thread nền làm mới trước khi hết hạn (chỉ 1 worker gọi mạng nhờ single-flight)
+- Làm mới lỗi thì tiếp tục dùng bản cũ; key bị Google rút khỏi JWKS không còn được tin
+  (có thể đã lộ), gặp kid lạ thì client tải lại JWKS ngay
+
+IdP giả lập để thử ở máy local (đặt GOOGLE_METADATA_URL=http://127.0.0.1:9000/.well-known/openid-configuration):
+    python oidc_cache.py stand-in-idp --port 9000 --max-age 60
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+
+import requests
+from authlib.integrations.flask_client import FlaskOAuth2App
+
+NAMESPACE = 'oidc'
+MAX_AGE_RE = re.compile(r'max-age\s*=\s*(\d+)', re.IGNORECASE)
+
+
+class OIDCDocumentCache:
+    def __init__(self, cache, timeout=5, default_max_age=3600, min_max_age=60, max_max_age=86400,
+                 stale_for=7 * 86400, force_interval=60):
+        self.cache = cache
+        self.timeout = timeout
+        self.default_max_age = default_max_age
+        self.min_max_age = min_max_age
+        self.max_max_age = max_max_age
+        self.stale_for = stale_for
+        self.force_interval = force_interval
+        self._refresher_pid = None
+        self._refresher_lock = threading.Lock()
+
+    # --- tải tài liệu ---
+    def _max_age(self, headers):
+        cache_control = headers.get('Cache-Control', '')
+        if 'no-store' in cache_control or 'no-cache' in cache_control:
+            return self.min_max_age
+        m = MAX_AGE_RE.search(cache_control)
+        if not m:
+            return self.default_max_age
+        age = int(m.group(1)) - int(headers.get('Age', 0) or 0)
+        return max(self.min_max_age, min(self.max_max_age, age))
+
+    def _fetch(self, url):
+        resp = requests.get(url, timeout=self.timeout)
+        resp.raise_for_status()
+        return {'document': resp.json(), 'max_age': self._max_age(resp.headers), 'fetched_at': time.time()}
+
+    def _refresh(self, url):
+        return self.cache.refresh(NAMESPACE, url, lambda: self._fetch(url),
+                                  ttl=lambda e: e['max_age'], stale_ttl=self.stale_for)
+
+    def _entry(self, url):
+        return self.cache.get_or_refresh(NAMESPACE, url, lambda: self._fetch(url),
+                                         ttl=lambda e: e['max_age'], stale_ttl=self.stale_for)
+
+    # --- API cho client OAuth ---
+    def document(self, url):
+        return self._entry(url)['document']
+
+    def jwks(self, url, force=False):
+        """JWKS hiện tại. force=True khi gặp kid lạ (có giới hạn tần suất)"""
+        entry = self._entry(url)
+        if force and time.time() - entry['fetched_at'] > self.force_interval:
+            try:
+                entry = self._refresh(url) or self.cache.peek(NAMESPACE, url, entry)
+            except Exception as e:
+                print(f"OIDC: không làm mới được JWKS, dùng bản cũ: {e}")
+        return {'keys': list(entry['document'].get('keys', []))}
+
+    # --- làm mới nền ---
+    def refresh_due(self, metadata_url):
+        """Làm mới các tài liệu đã dùng quá 80% thời gian sống (hoặc chưa có)"""
+        urls = [metadata_url]
+        metadata = self.cache.peek(NAMESPACE, metadata_url)
+        if metadata and metadata['document'].get('jwks_uri'):
+            urls.append(metadata['document']['jwks_uri'])
+        for url in urls:
+            entry = self.cache.peek(NAMESPACE, url)
+            if entry and time.time() < entry['fetched_at'] + entry['max_age'] * 0.8:
+                continue
+            try:
+                self._refresh(url)
+            except Exception as e:
+                print(f"OIDC: làm mới {url} lỗi, tiếp tục dùng bản cũ: {e}")
+
+    def start_background_refresh(self, metadata_url, poll=30):
+        """Khởi động thread nền (1 thread mỗi process, gọi lại sau khi fork vẫn an toàn)"""
+        if self._refresher_pid == os.getpid():
+            return
+        with self._refresher_lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+
+            def loop():
+                while True:
+                    self.refresh_due(metadata_url)
+                    time.sleep(poll)
+
+            threading.Thread(target=loop, name='oidc-refresh', daemon=True).start()
+
+
+def cached_openid_app(document_cache):
+    """Lớp client Authlib đọc discovery/JWKS qua OIDCDocumentCache (dùng với client_cls=...)"""
+
+    class CachedOpenIDApp(FlaskOAuth2App):
+        def load_server_metadata(self):
+            if self._server_metadata_url:
+                self.server_metadata.update(document_cache.document(self._server_metadata_url))
+            return self.server_metadata
+
+        def fetch_jwk_set(self, force=False):
+            uri = self.load_server_metadata().get('jwks_uri')
+            if not uri:
+                return super().fetch_jwk_set(force)
+            return document_cache.jwks(uri, force=force)
+
+    return CachedOpenIDApp
+
+
+def run_stand_in_idp(port, max_age):
+    """IdP giả lập: discovery + JWKS có Cache-Control, POST /rotate đổi key, POST /fail bật/tắt lỗi 503"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from joserfc.jwk import RSAKey
+
+    issuer = f'http://127.0.0.1:{port}'
+    state = {'keys': [RSAKey.generate_key(2048, parameters={'kid': 'k1'})], 'failing': False, 'hits': {}}
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', f'public, max-age={max_age}')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            state['hits'][self.path] = state['hits'].get(self.path, 0) + 1
+            if state['failing']:
+                return self._send(503, {'error': 'unavailable'})
+            if self.path == '/.well-known/openid-configuration':
+                return self._send(200, {
+                    'issuer': issuer,
+                    'authorization_endpoint': f'{issuer}/auth',
+                    'token_endpoint': f'{issuer}/token',
+                    'userinfo_endpoint': f'{issuer}/userinfo',
+                    'jwks_uri': f'{issuer}/jwks',
+                    'id_token_signing_alg_values_supported': ['RS256'],
+                })
+            if self.path == '/jwks':
+                return self._send(200, {'keys': [k.as_dict(private=False) for k in state['keys']]})
+            if self.path == '/stats':
+                return self._send(200, state['hits'])
+            return self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path == '/rotate':
+                kid = f"k{int(state['keys'][-1].kid[1:]) + 1}"
+                state['keys'] = [RSAKey.generate_key(2048, parameters={'kid': kid})]
+                return self._send(200, {'kid': kid})
+            if self.path == '/fail':
+                state['failing'] = not state['failing']
+                return self._send(200, {'failing': state['failing']})
+            return self._send(404, {'error': 'not found'})
+
+        def log_message(self, *args):
+            pass
+
+    print(f"Stand-in IdP: {issuer}/.well-known/openid-configuration (max-age={max_age})")
+    ThreadingHTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cache OIDC discovery/JWKS')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('stand-in-idp', help='Chạy IdP giả lập ở local')
+    p.add_argument('--port', type=int, default=9000)
+    p.add_argument('--max-age', type=int, default=60)
+    args = parser.parse_args(argv)
+    run_stand_in_idp(args.port, args.max_age)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+Đối soát sao kê SePay/ngân hàng khi webhook bị lỡ (ví dụ lúc deploy).
+
+Cách dùng:
+    python reconcile_sepay.py statement.csv
+    python reconcile_sepay.py statement.json --unmatched unmatched.csv --dry-run
+
+Áp dụng cùng quy tắc với /api/sepay-webhook (mã DH..., WWM <id> <hash>, WWM NEW <hash>)
+nhưng xử lý cả file một lượt: tra cứu Transaction/User/Donation bằng truy vấn IN theo lô,
+cập nhật và thêm Donation bằng câu lệnh theo lô thay vì từng dòng ORM.
+Không gửi email cảm ơn cho các giao dịch được đối soát.
+"""
+import re
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+from datetime import datetime
+
+from sqlalchemy import bindparam, update, insert, or_, and_, func
+
+from app import app, db, invalidate_leaderboard, User, Transaction, Donation, DonationArchive, ORDER_CODE_RE, WWM_USER_RE, WWM_NEW_RE, VIP_MIN_AMOUNT
+
+CHUNK_SIZE = 1000
+
+# Tên cột thường gặp trong file xuất của SePay/ngân hàng
+# Mã giao dịch SePay: chính là giá trị webhook lưu vào Donation.transaction_id
+SEPAY_ID_COLUMNS = ('id', 'transaction_id')
+# Mã tham chiếu ngân hàng: chỉ dùng để bỏ trùng trong file, không so được với Donation
+BANK_REF_COLUMNS = ('referenceCode', 'reference_number', 'Mã GD')
+DESCRIPTION_COLUMNS = ('description', 'content', 'transaction_content', 'Nội dung')
+AMOUNT_COLUMNS = ('transferAmount', 'transfer_amount', 'amount_in', 'amount', 'Số tiền vào')
+TYPE_COLUMNS = ('transferType', 'transfer_type')
+OUT_AMOUNT_COLUMNS = ('amount_out', 'Số tiền ra')
+# Phần nguyên: chỉ chữ số, hoặc nhóm hàng nghìn dùng cùng một dấu ('50.000' / '50,000')
+INTEGER_RE = re.compile(r'^(?:\d+|\d{1,3}(?:\.\d{3})+|\d{1,3}(?:,\d{3})+)$')
+CURRENCY_RE = re.compile(r'\s+|vnđ|vnd|đ|₫', re.IGNORECASE)
+
+
+def _pick(row, columns):
+    for col in columns:
+        if row.get(col) not in (None, ''):
+            return row[col]
+    return ''
+
+
+def _parse_amount(value):
+    """
+    Số tiền (giữ dấu) theo định dạng Việt Nam hoặc quốc tế, None nếu không đọc được:
+    '50.000' / '50,000' / '50.000,00' / '50,000.00' / '50000.5' -> 50000, '-50.000' / '(50.000)' -> -50000
+    VNĐ không có phần lẻ nên phần thập phân bị bỏ.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = CURRENCY_RE.sub('', str(value))
+    negative = text.startswith('-') or (text.startswith('(') and text.endswith(')'))
+    text = text.strip('()').lstrip('+-')
+    if not text:
+        return None
+    # Dấu phân cách cuối cùng là dấu thập phân nếu chỉ xuất hiện 1 lần và theo sau là 1-2 chữ số
+    sep = max(text.rfind('.'), text.rfind(','))
+    if sep >= 0 and text.count(text[sep]) == 1 and 1 <= len(text) - sep - 1 <= 2 and text[sep + 1:].isdigit():
+        text = text[:sep]
+    if not INTEGER_RE.match(text):
+        return None
+    amount = int(text.replace('.', '').replace(',', ''))
+    return -amount if negative else amount
+
+
+def _is_outgoing(raw):
+    """Dòng tiền ra (transferType = out hoặc có số tiền ra) không bao giờ được cộng cho ai"""
+    if str(_pick(raw, TYPE_COLUMNS)).strip().lower() == 'out':
+        return True
+    out_amount = _parse_amount(_pick(raw, OUT_AMOUNT_COLUMNS))
+    return bool(out_amount) and not _parse_amount(_pick(raw, AMOUNT_COLUMNS))
+
+
+def load_statement(path):
+    """Đọc file CSV/JSON, trả về list dict {id, description, amount}"""
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get('transactions', [])
+    else:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            data = list(csv.DictReader(f))
+
+    rows = []
+    for line_no, raw in enumerate(data, start=1):
+        amount_raw = _pick(raw, AMOUNT_COLUMNS)
+        sepay_id = str(_pick(raw, SEPAY_ID_COLUMNS)).strip()
+        rows.append({
+            'line': line_no,
+            'id': sepay_id or str(_pick(raw, BANK_REF_COLUMNS)).strip(),
+            'has_sepay_id': bool(sepay_id),
+            'description': str(_pick(raw, DESCRIPTION_COLUMNS)),
+            'amount': _parse_amount(amount_raw),
+            'amount_raw': str(amount_raw),
+            'outgoing': _is_outgoing(raw),
+        })
+    return rows
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _email_hash(email):
+    return hashlib.md5(email.lower().encode()).hexdigest()
+
+
+def reconcile(rows, dry_run=False):
+    """Khớp và áp dụng toàn bộ sao kê, trả về (thống kê, danh sách dòng không khớp)"""
+    unmatched = []
+    stats = {'rows': len(rows), 'orders': 0, 'user_donations': 0, 'new_user_donations': 0}
+
+    # 1. Phân loại dòng bằng regex đã biên dịch, bỏ trùng mã giao dịch trong file
+    seen_ids = set()
+    order_rows, user_rows, new_rows = [], [], []
+    for row in rows:
+        if not row['id']:
+            unmatched.append((row, 'Thiếu mã giao dịch'))
+            continue
+        if row['id'] in seen_ids:
+            unmatched.append((row, 'Trùng mã giao dịch trong file'))
+            continue
+        seen_ids.add(row['id'])
+        # Không lấy trị tuyệt đối: tiền ra / hoàn tiền có mã DH... không được tính là thanh toán
+        if row.get('outgoing') or (row['amount'] is not None and row['amount'] < 0):
+            unmatched.append((row, 'Giao dịch tiền ra / số tiền âm'))
+            continue
+        if not row['amount']:
+            unmatched.append((row, 'Số tiền không hợp lệ'))
+            continue
+
+        m = ORDER_CODE_RE.search(row['description'])
+        if m:
+            row['order_code'] = m.group(1)
+            order_rows.append(row)
+            continue
+        m = WWM_USER_RE.search(row['description']) or WWM_NEW_RE.search(row['description'])
+        if m and not row.get('has_sepay_id', True):
+            # Donate WWM chỉ chống cộng trùng được qua Donation.transaction_id (= id SePay mà webhook lưu),
+            # sao kê ngân hàng chỉ có mã tham chiếu thì không biết webhook đã cộng hay chưa
+            unmatched.append((row, 'Donate WWM thiếu mã giao dịch SePay (cột id), không kiểm tra được trùng'))
+            continue
+        m = WWM_USER_RE.search(row['description'])
+        if m:
+            row['user_id'], row['email_hash'] = int(m.group(1)), m.group(2).lower()
+            user_rows.append(row)
+            continue
+        m = WWM_NEW_RE.search(row['description'])
+        if m:
+            row['email_hash'] = m.group(1).lower()
+            new_rows.append(row)
+            continue
+        unmatched.append((row, 'Không có mã DH/WWM'))
+
+    # 2. Bỏ các giao dịch đã có trong bảng Donation (kể cả bảng archive)
+    processed = set()
+    for chunk in _chunks(seen_ids):
+        for model in (Donation, DonationArchive):
+            processed.update(tid for (tid,) in db.session.query(model.transaction_id)
+                             .filter(model.transaction_id.in_(chunk)))
+
+    def fresh(group):
+        keep = []
+        for row in group:
+            if row['id'] in processed:
+                unmatched.append((row, 'Giao dịch đã xử lý rồi'))
+            else:
+                keep.append(row)
+        return keep
+
+    order_rows, user_rows, new_rows = fresh(order_rows), fresh(user_rows), fresh(new_rows)
+
+    donations = []        # các dòng Donation cần thêm
+    credits = {}          # user_id -> tham số cho câu UPDATE user (b_id, b_amt, b_vip, b_old)
+    paid_orders = []      # id Transaction chuyển sang SUCCESS
+
+    def credit(user_id, row, vip=False, old=False):
+        c = credits.setdefault(user_id, {'b_id': user_id, 'b_amt': 0, 'b_vip': False, 'b_old': False})
+        c['b_amt'] += row['amount']
+        c['b_vip'] = c['b_vip'] or vip
+        c['b_old'] = c['b_old'] or old
+        donations.append({'user_id': user_id, 'amount': row['amount'], 'transaction_id': row['id']})
+
+    # 3. Đơn hàng DH...: một truy vấn IN cho mỗi lô mã đơn
+    orders = {}
+    for chunk in _chunks({r['order_code'] for r in order_rows}):
+        for t in db.session.query(Transaction.id, Transaction.order_code, Transaction.user_id,
+                                  Transaction.amount, Transaction.status)\
+                .filter(Transaction.order_code.in_(chunk)):
+            orders[t.order_code] = t
+    existing_users = set()
+    order_user_ids = {t.user_id for t in orders.values() if t.user_id}
+    for chunk in _chunks(order_user_ids):
+        existing_users.update(uid for (uid,) in db.session.query(User.id).filter(User.id.in_(chunk)))
+
+    claimed_orders = set()
+    for row in order_rows:
+        t = orders.get(row['order_code'])
+        if not t:
+            unmatched.append((row, 'Đơn hàng không tồn tại'))
+        elif t.status == 'SUCCESS' or t.id in claimed_orders:
+            unmatched.append((row, 'Đơn hàng đã xử lý rồi'))
+        elif row['amount'] < (t.amount or 0):
+            unmatched.append((row, 'Chuyển thiếu tiền'))
+        elif t.user_id not in existing_users:
+            unmatched.append((row, 'Không tìm thấy người dùng'))
+        else:
+            claimed_orders.add(t.id)
+            paid_orders.append({'b_id': t.id})
+            credit(t.user_id, row, vip=row['amount'] >= VIP_MIN_AMOUNT)
+            stats['orders'] += 1
+
+    # 4. WWM <user_id> <email_hash>: lấy email theo lô id
+    emails = {}
+    for chunk in _chunks({r['user_id'] for r in user_rows}):
+        emails.update(db.session.query(User.id, User.email).filter(User.id.in_(chunk), User.email.isnot(None)))
+    for row in user_rows:
+        email = emails.get(row['user_id'])
+        if email and _email_hash(email) == row['email_hash']:
+            credit(row['user_id'], row, old=True)
+            stats['user_donations'] += 1
+        else:
+            unmatched.append((row, 'Sai user/email hash'))
+
+    # 5. WWM NEW <email_hash>: PostgreSQL tự tính md5, DB khác thì quét email 1 lần
+    hash_to_user = {}
+    wanted = {r['email_hash'] for r in new_rows}
+    if wanted:
+        if db.engine.dialect.name == 'postgresql':
+            email_md5 = func.md5(func.lower(User.email))
+            for chunk in _chunks(wanted):
+                for uid, h in db.session.query(User.id, email_md5).filter(email_md5.in_(chunk)).order_by(User.id):
+                    hash_to_user.setdefault(h, uid)
+        else:
+            for uid, email in db.session.query(User.id, User.email).filter(User.email.isnot(None)).order_by(User.id):
+                h = _email_hash(email)
+                if h in wanted:
+                    hash_to_user.setdefault(h, uid)
+    for row in new_rows:
+        uid = hash_to_user.get(row['email_hash'])
+        if uid:
+            credit(uid, row, old=True)
+            stats['new_user_donations'] += 1
+        else:
+            unmatched.append((row, 'Chưa có tài khoản với email hash này'))
+
+    # 6. Ghi toàn bộ thay đổi bằng câu lệnh theo lô trong một transaction
+    user_table, trans_table = User.__table__, Transaction.__table__
+    mark_paid = update(trans_table)\
+        .where(and_(trans_table.c.id == bindparam('b_id'), trans_table.c.status != 'SUCCESS'))\
+        .values(status='SUCCESS', updated_at=datetime.utcnow())
+    # Giống webhook: đơn DH >= 10k thì VIP, donate kiểu cũ thì xét tổng tiền tích lũy
+    add_credit = update(user_table)\
+        .where(user_table.c.id == bindparam('b_id'))\
+        .values(total_donated=func.coalesce(user_table.c.total_donated, 0) + bindparam('b_amt'),
+                is_donor=or_(user_table.c.is_donor.is_(True), bindparam('b_vip'),
+                             and_(bindparam('b_old'),
+                                  func.coalesce(user_table.c.total_donated, 0) + bindparam('b_amt') >= VIP_MIN_AMOUNT)))
+    try:
+        for chunk in _chunks(paid_orders):
+            db.session.execute(mark_paid, chunk)
+        for chunk in _chunks(credits.values()):
+            db.session.execute(add_credit, chunk)
+        for chunk in _chunks(donations):
+            db.session.execute(insert(Donation.__table__), chunk)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+            if donations:
+                invalidate_leaderboard()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    stats['applied'] = len(donations)
+    stats['unmatched'] = len(unmatched)
+    return stats, unmatched
+
+
+def write_unmatched(path, unmatched):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['line', 'id', 'amount', 'description', 'reason'])
+        for row, reason in unmatched:
+            writer.writerow([row['line'], row['id'], row.get('amount_raw', row['amount']), row['description'], reason])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Đối soát sao kê SePay hàng loạt')
+    parser.add_argument('statement', help='File sao kê .csv hoặc .json')
+    parser.add_argument('--unmatched', help='Ghi các dòng không khớp ra file CSV')
+    parser.add_argument('--dry-run', action='store_true', help='Chỉ kiểm tra, không ghi vào database')
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        started = time.perf_counter()
+        rows = load_statement(args.statement)
+        stats, unmatched = reconcile(rows, dry_run=args.dry_run)
+        elapsed = time.perf_counter() - started
+
+    print(f"{'[DRY RUN] ' if args.dry_run else ''}Đã đọc {stats['rows']} dòng trong {elapsed:.2f}s")
+    print(f"  Đơn DH thành công:        {stats['orders']}")
+    print(f"  Donate WWM <id>:          {stats['user_donations']}")
+    print(f"  Donate WWM NEW:           {stats['new_user_donations']}")
+    print(f"  Không khớp:               {stats['unmatched']}")
+    if args.unmatched:
+        write_unmatched(args.unmatched, unmatched)
+        print(f"  -> chi tiết: {args.unmatched}")
+    elif unmatched:
+        for row, reason in unmatched[:20]:
+            print(f"  dòng {row['line']}: {row['id']} {row.get('amount_raw', row['amount'])} - {reason}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
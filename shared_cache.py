@@ -0,0 +1,261 @@
+"""
+Cache dùng chung giữa các worker gunicorn, lưu trong một file SQLite (chế độ WAL).
+
+- TTL: mỗi mục có fresh_until (còn mới) và stale_until (còn dùng tạm khi đang làm mới),
+  TTL có thể là hàm tính từ giá trị vừa tải
+- Key có phiên bản theo namespace: invalidate('leaderboard') tăng version, key cũ tự bị bỏ
+- Giới hạn dung lượng: vượt max_bytes thì xóa mục hết hạn trước, sau đó mục cũ nhất
+- Single-flight: chỉ 1 process gọi loader cho mỗi key, process khác dùng bản cũ hoặc chờ
+
+Không cần dịch vụ ngoài (Redis...), chỉ cần các worker dùng chung một ổ đĩa.
+
+Benchmark nhiều process:
+    python shared_cache.py bench --procs 4 --seconds 20
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    fresh_until REAL NOT NULL,
+    stale_until REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_entries_stale_until ON entries (stale_until);
+CREATE TABLE IF NOT EXISTS versions (namespace TEXT PRIMARY KEY, version INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);
+"""
+
+
+class SharedCache:
+    def __init__(self, path, max_bytes=32 * 1024 * 1024, lock_timeout=30.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        self._local = threading.local()
+        self._owner = uuid.uuid4().hex
+        self._conn()
+
+    def _conn(self):
+        # Mỗi thread/process một connection riêng (an toàn khi gunicorn fork sau khi import app)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    # --- key có phiên bản ---
+    def _version(self, namespace):
+        row = self._conn().execute('SELECT version FROM versions WHERE namespace = ?', (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def _full_key(self, namespace, key):
+        return f"{namespace}:v{self._version(namespace)}:{key}"
+
+    def invalidate(self, namespace):
+        """Bỏ toàn bộ key của namespace bằng cách tăng version (mục cũ bị evict dần)"""
+        self._conn().execute(
+            'INSERT INTO versions (namespace, version) VALUES (?, 1) '
+            'ON CONFLICT(namespace) DO UPDATE SET version = version + 1', (namespace,))
+
+    # --- đọc / ghi ---
+    def _read(self, full_key):
+        row = self._conn().execute(
+            'SELECT value, fresh_until, stale_until FROM entries WHERE key = ?', (full_key,)).fetchone()
+        if not row or row[2] < time.time():
+            return None
+        return json.loads(row[0]), row[1] >= time.time()
+
+    def get(self, namespace, key, default=None):
+        hit = self._read(self._full_key(namespace, key))
+        return hit[0] if hit and hit[1] else default
+
+    def peek(self, namespace, key, default=None):
+        """Như get() nhưng trả cả bản đã hết hạn (còn trong stale window)"""
+        hit = self._read(self._full_key(namespace, key))
+        return hit[0] if hit else default
+
+    def items(self, namespace):
+        """Các mục còn mới của namespace (phiên bản hiện tại), dạng list (key, value)"""
+        prefix = f"{namespace}:v{self._version(namespace)}:"
+        # Khoảng [prefix, prefix kết thúc bằng ';') thay cho LIKE để không phải escape key
+        rows = self._conn().execute(
+            'SELECT key, value FROM entries WHERE key >= ? AND key < ? AND fresh_until >= ?',
+            (prefix, prefix[:-1] + ';', time.time())).fetchall()
+        return [(key[len(prefix):], json.loads(value)) for key, value in rows]
+
+    def set(self, namespace, key, value, ttl, stale_ttl=None):
+        self._write(self._full_key(namespace, key), value, ttl, stale_ttl)
+
+    def _write(self, full_key, value, ttl, stale_ttl):
+        # ttl có thể là hàm tính từ giá trị (ví dụ theo header Cache-Control)
+        if callable(ttl):
+            ttl = ttl(value)
+        if callable(stale_ttl):
+            stale_ttl = stale_ttl(value)
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            'INSERT OR REPLACE INTO entries (key, value, size, stored_at, fresh_until, stale_until) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (full_key, payload, len(payload), now, now + ttl, now + ttl + (stale_ttl if stale_ttl is not None else ttl)))
+        self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        conn.execute('DELETE FROM entries WHERE stale_until < ?', (now,))
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        for key, size in conn.execute('SELECT key, size FROM entries ORDER BY stored_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+
+    # --- single-flight giữa các process ---
+    def _acquire(self, full_key):
+        now = time.time()
+        cur = self._conn().execute(
+            'INSERT INTO locks (key, owner, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+            'WHERE locks.expires_at < ?',
+            (full_key, self._owner, now + self.lock_timeout, now))
+        return cur.rowcount == 1
+
+    def _release(self, full_key):
+        self._conn().execute('DELETE FROM locks WHERE key = ? AND owner = ?', (full_key, self._owner))
+
+    def refresh(self, namespace, key, loader, ttl, stale_ttl=None):
+        """
+        Làm mới ngay (không quan tâm còn hạn hay không) nếu không process nào đang làm.
+        Trả về giá trị mới, hoặc None nếu process khác đang giữ khóa. Loader lỗi thì ném exception.
+        """
+        full_key = self._full_key(namespace, key)
+        if not self._acquire(full_key):
+            return None
+        try:
+            value = loader()
+            self._write(full_key, value, ttl, stale_ttl)
+            return value
+        finally:
+            self._release(full_key)
+
+    def get_or_refresh(self, namespace, key, loader, ttl, stale_ttl=None, wait=None):
+        """
+        Trả về giá trị trong cache, gọi loader() khi hết hạn.
+        Khi một process khác đang làm mới: trả bản cũ nếu còn, nếu không thì chờ tối đa `wait` giây.
+        Loader lỗi mà còn bản cũ thì dùng bản cũ, không thì ném lại exception.
+        """
+        full_key = self._full_key(namespace, key)
+        hit = self._read(full_key)
+        if hit and hit[1]:
+            return hit[0]
+
+        deadline = time.time() + (self.lock_timeout if wait is None else wait)
+        while True:
+            if self._acquire(full_key):
+                try:
+                    # Process khác có thể vừa làm mới xong trước khi mình lấy được khóa
+                    latest = self._read(full_key)
+                    if latest and latest[1]:
+                        return latest[0]
+                    try:
+                        value = loader()
+                    except Exception:
+                        if hit:
+                            return hit[0]
+                        raise
+                    self._write(full_key, value, ttl, stale_ttl)
+                    return value
+                finally:
+                    self._release(full_key)
+
+            if hit:
+                return hit[0]
+            time.sleep(0.05)
+            latest = self._read(full_key)
+            if latest:
+                return latest[0]
+            if time.time() > deadline:
+                # Chờ quá lâu: tự gọi loader, không để request treo
+                return loader()
+
+
+def _bench_worker(path, seconds, ttl, fetch_delay, counter_path, mode):
+    cache = SharedCache(path)
+    local = {}
+    fetches = 0
+    requests_done = 0
+    end = time.time() + seconds
+
+    def loader():
+        nonlocal fetches
+        fetches += 1
+        time.sleep(fetch_delay)
+        return [{'platform': 'pc', 'version_name': 'bench'}] * 50
+
+    while time.time() < end:
+        if mode == 'shared':
+            cache.get_or_refresh('catalog', 'all', loader, ttl)
+        else:
+            # Cache riêng từng process (cách làm mỗi worker tự nhớ)
+            if local.get('until', 0) < time.time():
+                local['value'], local['until'] = loader(), time.time() + ttl
+        requests_done += 1
+        time.sleep(0.005)
+    with open(counter_path, 'a') as f:
+        f.write(f"{fetches} {requests_done}\n")
+
+
+def bench(procs, seconds, ttl, fetch_delay):
+    import multiprocessing
+    for mode in ('per-process', 'shared'):
+        with tempfile.TemporaryDirectory() as workdir:
+            counter_path = os.path.join(workdir, 'counts.txt')
+            workers = [multiprocessing.Process(target=_bench_worker,
+                                               args=(os.path.join(workdir, 'cache.sqlite3'), seconds, ttl,
+                                                     fetch_delay, counter_path, mode))
+                       for _ in range(procs)]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+            with open(counter_path) as f:
+                counts = [tuple(map(int, line.split())) for line in f if line.strip()]
+            fetches = sum(c[0] for c in counts)
+            served = sum(c[1] for c in counts)
+            print(f"{mode:12s}: {procs} process, TTL {ttl}s -> {fetches / seconds * 60:7.1f} lần gọi upstream/phút "
+                  f"({served / seconds:,.0f} request/s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark cache dùng chung nhiều process')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('bench')
+    p.add_argument('--procs', type=int, default=4)
+    p.add_argument('--seconds', type=float, default=20)
+    p.add_argument('--ttl', type=float, default=2)
+    p.add_argument('--fetch-delay', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    bench(args.procs, args.seconds, args.ttl, args.fetch_delay)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py đọc cấu hình lúc import nên phải đặt biến môi trường trước khi import
+TEST_ROOT = tempfile.mkdtemp(prefix='wwm_test_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(TEST_ROOT, 'test.db')}"
+os.environ['RESOURCES_MPK_PATH'] = os.path.join(TEST_ROOT, 'Resources.mpk')
+os.environ['BUNDLE_DIR'] = os.path.join(TEST_ROOT, 'bundles')
+os.environ['SHARED_CACHE_PATH'] = os.path.join(TEST_ROOT, 'shared_cache.sqlite3')
+# Không gọi Google thật từ thread làm mới nền
+os.environ['GOOGLE_METADATA_URL'] = 'http://127.0.0.1:9/.well-known/openid-configuration'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app_module():
+    import app as app_module
+    with app_module.app.app_context():
+        app_module.db.create_all()
+    yield app_module
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+
+
+@pytest.fixture
+def donor_client(app_module):
+    """Test client đã đăng nhập bằng tài khoản VIP"""
+    with app_module.app.app_context():
+        user = app_module.User(username='vip@example.com', email='vip@example.com', is_donor=True)
+        app_module.db.session.add(user)
+        app_module.db.session.commit()
+        user_id = user.id
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    return client
@@ -0,0 +1,83 @@
+import os
+import glob
+import json
+import tempfile
+import time
+from io import BytesIO
+
+import pytest
+
+
+def _batch_dirs():
+    return set(glob.glob(os.path.join(tempfile.gettempdir(), 'wwm_batch_*')))
+
+
+def _wait_removed(before, timeout=10):
+    # Thư mục tạm do job cuối cùng xóa trong callback, có thể trễ hơn dòng kết quả cuối một chút
+    deadline = time.time() + timeout
+    while _batch_dirs() != before and time.time() < deadline:
+        time.sleep(0.05)
+    return _batch_dirs() == before
+
+
+@pytest.fixture
+def mpk(app_module):
+    with open(app_module.RESOURCES_MPK_PATH, 'wb') as f:
+        f.write(os.urandom(1024 * 1024))
+
+
+@pytest.mark.parametrize('sets', [
+    'not json',
+    '{"normal": "a"}',
+    '[{"normal": ["a"]}]',
+    '[{"normal": "a", "title": {"x": 1}}]',
+    '[{"name": "thiếu normal"}]',
+])
+def test_bad_sets_rejected_without_leaking_temp_dir(donor_client, mpk, sets):
+    before = _batch_dirs()
+    resp = donor_client.post('/api/build-bundles',
+                             data={'sets': sets, 'a': (BytesIO(b'font'), 'a.ttf')},
+                             content_type='multipart/form-data')
+    assert resp.status_code == 400
+    assert _batch_dirs() == before
+
+
+def test_batch_streams_one_line_per_set(donor_client, mpk):
+    before = _batch_dirs()
+    sets = [{'name': 'A', 'normal': 'a'}, {'name': 'B', 'normal': 'b', 'title': 'a'}]
+    resp = donor_client.post('/api/build-bundles',
+                             data={'sets': json.dumps(sets),
+                                   'a': (BytesIO(os.urandom(4096)), 'a.ttf'),
+                                   'b': (BytesIO(os.urandom(4096)), 'b.ttf')},
+                             content_type='multipart/form-data')
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert sorted(line['name'] for line in lines) == ['A', 'B']
+    assert all(line['success'] for line in lines)
+    assert _wait_removed(before)
+
+
+def test_disconnect_removes_temp_dir_after_jobs(donor_client, mpk):
+    before = _batch_dirs()
+    data = {'font_file': [(BytesIO(os.urandom(4096)), f'{i}.ttf') for i in range(6)]}
+    resp = donor_client.post('/api/build-bundles', data=data, content_type='multipart/form-data', buffered=False)
+    first = json.loads(next(resp.response))
+    assert first['success']
+    # Client ngắt sau dòng đầu tiên
+    resp.close()
+    assert _wait_removed(before)
+
+
+def test_bundle_id_separates_roles(app_module, mpk, tmp_path):
+    title = os.urandom(1024)
+    prefix = os.urandom(2048)
+    # normal = prefix + "|title|" + title phải khác bộ (normal = prefix, title = title)
+    joined = tmp_path / 'joined.ttf'
+    joined.write_bytes(prefix + b'|title|' + title)
+    normal = tmp_path / 'normal.ttf'
+    normal.write_bytes(prefix)
+    title_path = tmp_path / 'title.ttf'
+    title_path.write_bytes(title)
+
+    fingerprint = app_module.assets_fingerprint()
+    assert (app_module.build_bundle(str(joined), fingerprint=fingerprint)
+            != app_module.build_bundle(str(normal), str(title_path), fingerprint=fingerprint))
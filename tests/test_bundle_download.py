@@ -0,0 +1,110 @@
+import os
+import json
+import random
+import time
+from io import BytesIO
+
+import pytest
+
+
+@pytest.fixture
+def bundle_url(app_module, donor_client):
+    with open(app_module.RESOURCES_MPK_PATH, 'wb') as f:
+        f.write(os.urandom(3 * 1024 * 1024))
+    resp = donor_client.post('/api/build-bundle',
+                             data={'font_file': (BytesIO(os.urandom(64 * 1024)), 'font.ttf')},
+                             content_type='multipart/form-data')
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    return resp.get_json()['download_url']
+
+
+def test_resume_after_cut_at_random_offset(donor_client, bundle_url):
+    full = donor_client.get(bundle_url)
+    assert full.status_code == 200
+    body, etag = full.get_data(), full.headers['ETag']
+
+    cut = random.randrange(1, len(body) - 1)
+    resumed = donor_client.get(bundle_url, headers={'Range': f'bytes={cut}-', 'If-Range': etag})
+    assert resumed.status_code == 206
+    assert resumed.headers['Content-Range'] == f'bytes {cut}-{len(body) - 1}/{len(body)}'
+    assert body[:cut] + resumed.get_data() == body
+
+
+def test_if_range_mismatch_returns_full_body(donor_client, bundle_url):
+    full = donor_client.get(bundle_url).get_data()
+    resp = donor_client.get(bundle_url, headers={'Range': 'bytes=100-', 'If-Range': '"stale-etag"'})
+    assert resp.status_code == 200
+    assert resp.get_data() == full
+
+
+def test_if_none_match_returns_not_modified(donor_client, bundle_url):
+    etag = donor_client.get(bundle_url).headers['ETag']
+    resp = donor_client.get(bundle_url, headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+
+
+def test_prune_keeps_prebuilt_and_recent_bundles(app_module):
+    os.makedirs(app_module.BUNDLE_DIR, exist_ok=True)
+    old = time.time() - 48 * 3600
+
+    def make(name, mtime):
+        path = os.path.join(app_module.BUNDLE_DIR, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 1024)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    prebuilt = make('a' * 64 + '.zip', old)
+    expired = make('b' * 64 + '.zip', old)
+    recent = make('c' * 64 + '.zip', time.time())
+    with open(app_module.PREBUILT_INDEX, 'w', encoding='utf-8') as f:
+        json.dump([{'id': 'roboto', 'bundle_id': 'a' * 64}], f)
+    try:
+        # Giới hạn dung lượng 0 byte: bundle vừa tạo vẫn được giữ trong BUNDLE_MIN_AGE_SECONDS
+        app_module.prune_bundles(max_bytes=0, max_age_hours=24)
+        assert os.path.exists(prebuilt)
+        assert not os.path.exists(expired)
+        assert os.path.exists(recent)
+    finally:
+        os.remove(app_module.PREBUILT_INDEX)
+
+
+def test_download_is_privately_cacheable(donor_client, bundle_url):
+    cache_control = donor_client.get(bundle_url).headers['Cache-Control']
+    assert 'private' in cache_control
+    assert 'public' not in cache_control
+
+
+def test_font_tool_uses_upload_for_all_slots(app_module, donor_client, bundle_url):
+    import zipfile
+    archive = zipfile.ZipFile(BytesIO(donor_client.get(bundle_url).get_data()))
+    fonts = 'Engine/Content/Fonts'
+    normal = archive.read(f'{fonts}/normal.ttf')
+    assert archive.read(f'{fonts}/title.ttf') == normal
+    assert archive.read(f'{fonts}/art.ttf') == normal
+
+
+def test_missing_mpk_fails_without_charging_trial(app_module):
+    if os.path.exists(app_module.RESOURCES_MPK_PATH):
+        os.remove(app_module.RESOURCES_MPK_PATH)
+    with app_module.app.app_context():
+        user = app_module.User(username='trial@example.com', email='trial@example.com', free_trials=1)
+        app_module.db.session.add(user)
+        app_module.db.session.commit()
+        user_id = user.id
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+
+    os.makedirs(app_module.BUNDLE_DIR, exist_ok=True)
+    def bundles():
+        return {name for name in os.listdir(app_module.BUNDLE_DIR) if name.endswith(('.zip', '.part'))}
+
+    before = bundles()
+    resp = client.post('/api/build-bundle', data={'font_file': (BytesIO(os.urandom(4096)), 'font.ttf')},
+                       content_type='multipart/form-data')
+    assert resp.status_code == 500
+    with app_module.app.app_context():
+        assert app_module.db.session.get(app_module.User, user_id).free_trials == 1
+    assert bundles() == before
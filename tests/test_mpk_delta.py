@@ -0,0 +1,101 @@
+import os
+import random
+
+import pytest
+
+import mpk_delta
+from mpk_delta import DeltaError, apply_delta, make_delta
+
+BLOCK = 4096
+
+
+@pytest.fixture
+def old_file(tmp_path):
+    path = tmp_path / 'old.mpk'
+    path.write_bytes(random.Random(1).randbytes(300 * 1024))
+    return path
+
+
+def _round_trip(tmp_path, old_file, new_bytes):
+    new_path = tmp_path / 'new.mpk'
+    new_path.write_bytes(new_bytes)
+    delta_path = tmp_path / 'patch.wdelta'
+    stats = make_delta(str(old_file), str(new_path), str(delta_path), BLOCK)
+    out_path = tmp_path / 'out.mpk'
+    apply_delta(str(old_file), str(delta_path), str(out_path))
+    assert out_path.read_bytes() == new_bytes
+    return stats
+
+
+def test_same_length_overwrite(tmp_path, old_file):
+    data = bytearray(old_file.read_bytes())
+    data[100_000:100_100] = os.urandom(100)
+    stats = _round_trip(tmp_path, old_file, bytes(data))
+    assert stats['literal_bytes'] <= BLOCK
+
+
+@pytest.mark.parametrize('edit', ['insert_front', 'delete_middle', 'longer_strings'])
+def test_length_changing_edits_reuse_old_blocks(tmp_path, old_file, edit):
+    data = old_file.read_bytes()
+    if edit == 'insert_front':
+        new = b'abc' + data
+    elif edit == 'delete_middle':
+        new = data[:150_000] + data[150_007:]
+    else:
+        new = data[:50_000] + b'chuoi dich dai hon' + data[50_010:200_000] + b'x' + data[200_020:]
+    stats = _round_trip(tmp_path, old_file, new)
+    # Chỉ vài block quanh chỗ sửa (và phần lẻ cuối file) là dữ liệu mới
+    assert stats['copied_bytes'] >= len(new) - 4 * BLOCK
+    assert stats['delta_bytes'] < len(new) // 10
+
+
+def test_wrong_old_file_rejected(tmp_path, old_file):
+    new_path = tmp_path / 'new.mpk'
+    new_path.write_bytes(b'xyz' + old_file.read_bytes())
+    delta_path = tmp_path / 'patch.wdelta'
+    make_delta(str(old_file), str(new_path), str(delta_path), BLOCK)
+
+    other = tmp_path / 'other.mpk'
+    other.write_bytes(os.urandom(old_file.stat().st_size))
+    with pytest.raises(DeltaError):
+        apply_delta(str(other), str(delta_path), str(tmp_path / 'out.mpk'))
+    assert not (tmp_path / 'out.mpk').exists()
+
+
+def test_wrong_new_hash_rejected(tmp_path, old_file):
+    new_path = tmp_path / 'new.mpk'
+    new_path.write_bytes(b'xyz' + old_file.read_bytes())
+    delta_path = tmp_path / 'patch.wdelta'
+    make_delta(str(old_file), str(new_path), str(delta_path), BLOCK)
+
+    raw = bytearray(delta_path.read_bytes())
+    raw[mpk_delta.HEADER.size - 1] ^= 0xFF  # byte cuối của new_sha256
+    delta_path.write_bytes(bytes(raw))
+    out_path = tmp_path / 'out.mpk'
+    with pytest.raises(DeltaError):
+        apply_delta(str(old_file), str(delta_path), str(out_path))
+    assert not out_path.exists()
+    assert not [p for p in tmp_path.iterdir() if p.suffix == '.part']
+
+
+@pytest.mark.parametrize('damage', ['truncate', 'corrupt_literal'])
+def test_damaged_delta_raises_delta_error(tmp_path, old_file, damage, capsys):
+    new_path = tmp_path / 'new.mpk'
+    new_path.write_bytes(os.urandom(20_000) + old_file.read_bytes())
+    delta_path = tmp_path / 'patch.wdelta'
+    make_delta(str(old_file), str(new_path), str(delta_path), BLOCK)
+
+    raw = delta_path.read_bytes()
+    if damage == 'truncate':
+        raw = raw[:len(raw) // 2]
+    else:
+        # Lệnh đầu tiên là LITERAL (20 KB ngẫu nhiên ở đầu file): phá dữ liệu zlib ngay sau header lệnh
+        start = mpk_delta.HEADER.size + 1 + mpk_delta.LITERAL_ARGS.size
+        raw = raw[:start] + bytes(b ^ 0xFF for b in raw[start:start + 64]) + raw[start + 64:]
+    delta_path.write_bytes(raw)
+
+    with pytest.raises(DeltaError):
+        apply_delta(str(old_file), str(delta_path), str(tmp_path / 'out.mpk'))
+    # Công cụ dòng lệnh báo lỗi gọn, không in traceback
+    assert mpk_delta.main(['apply', str(old_file), str(delta_path), str(tmp_path / 'out.mpk')]) == 1
+    assert '❌' in capsys.readouterr().out
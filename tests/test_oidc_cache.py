@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import socket
+import threading
+import subprocess
+
+import pytest
+import requests
+
+from oidc_cache import OIDCDocumentCache, run_stand_in_idp
+from shared_cache import SharedCache
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOCUMENT_PATHS = ('/.well-known/openid-configuration', '/jwks')
+
+
+@pytest.fixture(scope='module')
+def idp():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    threading.Thread(target=run_stand_in_idp, args=(port, 300), daemon=True).start()
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 10
+    while True:
+        try:
+            requests.get(f'{base}/stats', timeout=1)
+            break
+        except requests.ConnectionError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+    return base
+
+
+def _hits(idp):
+    stats = requests.get(f'{idp}/stats', timeout=5).json()
+    return {path: stats.get(path, 0) for path in DOCUMENT_PATHS}
+
+
+def _kids(jwks):
+    return {key['kid'] for key in jwks['keys']}
+
+
+def test_second_process_reuses_cached_documents(idp, tmp_path):
+    cache_path = str(tmp_path / 'cache.sqlite3')
+    documents = OIDCDocumentCache(SharedCache(cache_path))
+    metadata_url = f'{idp}/.well-known/openid-configuration'
+    jwks_uri = documents.document(metadata_url)['jwks_uri']
+    kids = _kids(documents.jwks(jwks_uri))
+    before = _hits(idp)
+
+    # Worker khác (process riêng) dùng chung file cache: không gọi IdP lần nào
+    script = (
+        'import sys\n'
+        'from oidc_cache import OIDCDocumentCache\n'
+        'from shared_cache import SharedCache\n'
+        'docs = OIDCDocumentCache(SharedCache(sys.argv[1]))\n'
+        'uri = docs.document(sys.argv[2])["jwks_uri"]\n'
+        'print(",".join(sorted(k["kid"] for k in docs.jwks(uri)["keys"])))\n'
+    )
+    out = subprocess.run([sys.executable, '-c', script, cache_path, metadata_url], cwd=REPO_ROOT,
+                         capture_output=True, text=True, timeout=60, check=True).stdout
+    assert set(out.strip().split(',')) == kids
+    assert _hits(idp) == before
+
+
+def test_outage_serves_cached_documents(idp, tmp_path):
+    # max_max_age=1: tài liệu hết hạn sau 1 giây, lần đọc sau phải thử gọi lại IdP
+    documents = OIDCDocumentCache(SharedCache(str(tmp_path / 'cache.sqlite3')), min_max_age=0, max_max_age=1)
+    metadata_url = f'{idp}/.well-known/openid-configuration'
+    metadata = documents.document(metadata_url)
+    jwks = documents.jwks(metadata['jwks_uri'])
+    time.sleep(1.1)
+
+    before = _hits(idp)
+    requests.post(f'{idp}/fail', timeout=5)
+    try:
+        assert documents.document(metadata_url) == metadata
+        assert documents.jwks(metadata['jwks_uri']) == jwks
+    finally:
+        requests.post(f'{idp}/fail', timeout=5)
+    # IdP đã bị gọi (và trả 503) nhưng client vẫn nhận bản cũ
+    after = _hits(idp)
+    assert all(after[path] > before[path] for path in DOCUMENT_PATHS)
+
+
+def test_rotation_drops_removed_kid(idp, tmp_path):
+    documents = OIDCDocumentCache(SharedCache(str(tmp_path / 'cache.sqlite3')), force_interval=0)
+    jwks_uri = documents.document(f'{idp}/.well-known/openid-configuration')['jwks_uri']
+    old_kids = _kids(documents.jwks(jwks_uri))
+
+    new_kid = requests.post(f'{idp}/rotate', timeout=5).json()['kid']
+    # Gặp kid lạ -> client gọi jwks(force=True): chỉ còn key Google đang công bố
+    assert _kids(documents.jwks(jwks_uri, force=True)) == {new_kid}
+    assert not old_kids & _kids(documents.jwks(jwks_uri))
@@ -0,0 +1,59 @@
+import os
+import threading
+
+from sqlalchemy import create_engine, text
+
+from db_pool import PoolMetrics, TimedQueuePool, aggregate_snapshots, install_pool_metrics, pool_metrics
+
+
+def test_snapshot_follows_pool_after_dispose(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=TimedQueuePool, pool_size=3, max_overflow=2)
+    previous = pool_metrics.engine
+    install_pool_metrics(engine)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+        old_pool = engine.pool
+        engine.dispose()
+        assert engine.pool is not old_pool
+        with engine.connect() as conn:
+            assert pool_metrics.snapshot()['checked_out'] == 1
+        snap = pool_metrics.snapshot()
+        assert snap['pid'] == os.getpid()
+        assert snap['checked_out'] == 0
+    finally:
+        pool_metrics.engine = previous
+        engine.dispose()
+
+
+def test_counters_are_thread_safe():
+    metrics = PoolMetrics()
+
+    def hammer():
+        for _ in range(5000):
+            metrics.record_connect()
+            metrics.record_invalidation()
+            metrics.record_invalidation(soft=True)
+
+    workers = [threading.Thread(target=hammer) for _ in range(8)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    snap = metrics.snapshot()
+    assert snap['connects'] == snap['invalidations'] == snap['soft_invalidations'] == 40000
+
+
+def test_api_aggregates_workers(app_module, monkeypatch):
+    monkeypatch.setenv('METRICS_API_KEY', 'secret')
+    other = dict(pool_metrics.snapshot(), pid=os.getpid() + 1, checkouts=7, connects=3)
+    app_module.publish_pool_metrics(other)
+
+    client = app_module.app.test_client()
+    assert client.get('/api/pool-metrics', headers={'Authorization': 'Apikey wrong'}).status_code == 401
+    body = client.get('/api/pool-metrics', headers={'Authorization': 'Apikey secret'}).get_json()
+    pids = [w['pid'] for w in body['workers']]
+    assert os.getpid() in pids and os.getpid() + 1 in pids
+    assert body['pool']['pid'] == os.getpid()
+    assert body['totals'] == aggregate_snapshots(body['workers'])
+    assert body['totals']['checkouts'] >= 7
@@ -0,0 +1,60 @@
+import os
+import json
+import time
+
+import pytest
+
+
+@pytest.fixture
+def prebuilt(app_module, tmp_path):
+    with open(app_module.RESOURCES_MPK_PATH, 'wb') as f:
+        f.write(os.urandom(1024 * 1024))
+    font = tmp_path / 'Roboto-Regular.ttf'
+    font.write_bytes(os.urandom(4096))
+    manifest = tmp_path / 'prebuilt_fonts.json'
+    manifest.write_text(json.dumps([{'id': 'roboto', 'name': 'Roboto', 'normal': font.name}]), encoding='utf-8')
+
+    import build_prebuilt
+    assert build_prebuilt.build_prebuilt(str(manifest))
+    yield app_module
+    os.remove(app_module.PREBUILT_INDEX)
+    if os.path.exists(app_module.assets_stamp_path()):
+        os.remove(app_module.assets_stamp_path())
+
+
+def _wait_hashed(app_module, timeout=10):
+    deadline = time.time() + timeout
+    while (fingerprint := app_module.current_assets_fingerprint()) is None:
+        assert time.time() < deadline, 'thread nền không hash xong assets'
+        time.sleep(0.05)
+    return fingerprint
+
+
+def test_page_view_reads_stamp_instead_of_hashing(prebuilt, monkeypatch):
+    # Worker mới (bộ nhớ trống): chỉ dùng stamp của build_prebuilt.py, không đọc Resources.mpk
+    monkeypatch.setattr(prebuilt, '_asset_hashes', {})
+    monkeypatch.setattr(prebuilt, '_hash_file', lambda *args: pytest.fail('page view không được hash assets'))
+    resp = prebuilt.app.test_client().get('/tools/font-editor')
+    assert resp.status_code == 200
+    assert [e['id'] for e in prebuilt.available_prebuilt()] == ['roboto']
+
+
+def test_fingerprint_ignores_mtime(prebuilt):
+    before = prebuilt.assets_fingerprint()
+    later = time.time() + 3600
+    # Giống một lần deploy/checkout mới: nội dung giữ nguyên, mtime đổi
+    os.utime(prebuilt.RESOURCES_MPK_PATH, (later, later))
+    # Stamp cũ không còn khớp mtime: hash lại ở thread nền rồi ghi stamp mới
+    assert _wait_hashed(prebuilt) == before
+    assert [e['id'] for e in prebuilt.available_prebuilt()] == ['roboto']
+    with open(prebuilt.assets_stamp_path(), encoding='utf-8') as f:
+        stamp = json.load(f)
+    assert stamp['files'][prebuilt.RESOURCES_MPK_PATH][1] == os.stat(prebuilt.RESOURCES_MPK_PATH).st_mtime_ns
+
+
+def test_fingerprint_follows_content(prebuilt):
+    before = prebuilt.assets_fingerprint()
+    with open(prebuilt.RESOURCES_MPK_PATH, 'ab') as f:
+        f.write(b'patch')
+    assert _wait_hashed(prebuilt) != before
+    assert prebuilt.available_prebuilt() == []
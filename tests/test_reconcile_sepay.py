@@ -0,0 +1,106 @@
+import csv
+import json
+
+import pytest
+
+
+@pytest.fixture
+def reconcile_sepay(app_module):
+    import reconcile_sepay
+    return reconcile_sepay
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('50.000', 50000),
+    ('50,000', 50000),
+    ('50000', 50000),
+    ('50.000,00', 50000),
+    ('50,000.00', 50000),
+    ('1.250.000,5', 1250000),
+    ('50000.00', 50000),
+    ('50.000 VND', 50000),
+    ('-50,000', -50000),
+    ('(50.000)', -50000),
+    (50000, 50000),
+    (-50000.0, -50000),
+    ('', None),
+    ('abc', None),
+    ('5,00,000', None),
+])
+def test_parse_amount(reconcile_sepay, text, expected):
+    assert reconcile_sepay._parse_amount(text) == expected
+
+
+def test_decimal_and_outgoing_rows(app_module, reconcile_sepay, tmp_path):
+    db, User, Transaction, Donation = app_module.db, app_module.User, app_module.Transaction, app_module.Donation
+    with app_module.app.app_context():
+        user = User(username='a@example.com', email='a@example.com', total_donated=0)
+        db.session.add(user)
+        db.session.flush()
+        for code in ('DH1', 'DH2', 'DH3'):
+            db.session.add(Transaction(order_code=code, user_id=user.id, amount=50000))
+        db.session.commit()
+        user_id = user.id
+
+    statement = tmp_path / 'statement.json'
+    statement.write_text(json.dumps([
+        {'id': 'T1', 'description': 'DH1 mua vip', 'transferAmount': '50.000,00'},
+        {'id': 'T2', 'description': 'hoan tien DH2', 'transferAmount': '-50,000'},
+        {'id': 'T3', 'description': 'DH3', 'transferAmount': '50.000', 'transferType': 'out'},
+    ]), encoding='utf-8')
+
+    with app_module.app.app_context():
+        stats, unmatched = reconcile_sepay.reconcile(reconcile_sepay.load_statement(str(statement)))
+        assert stats['orders'] == 1
+        assert db.session.get(User, user_id).total_donated == 50000
+        assert [d.amount for d in Donation.query.all()] == [50000]
+        statuses = {t.order_code: t.status for t in Transaction.query.all()}
+        assert statuses == {'DH1': 'SUCCESS', 'DH2': 'PENDING', 'DH3': 'PENDING'}
+
+    assert sorted(row['id'] for row, _ in unmatched) == ['T2', 'T3']
+    report = tmp_path / 'unmatched.csv'
+    reconcile_sepay.write_unmatched(str(report), unmatched)
+    with open(report, encoding='utf-8') as f:
+        rows = {r['id']: r for r in csv.DictReader(f)}
+    assert rows['T2']['amount'] == '-50,000'
+    assert rows['T2']['reason'] == rows['T3']['reason'] == 'Giao dịch tiền ra / số tiền âm'
+
+
+@pytest.mark.parametrize('description', ['WWM {uid} {hash}', 'WWM NEW {hash}'])
+def test_wwm_row_with_only_bank_reference_not_credited_twice(app_module, reconcile_sepay, monkeypatch,
+                                                             tmp_path, description):
+    import hashlib
+    db, User, Donation = app_module.db, app_module.User, app_module.Donation
+    monkeypatch.setenv('SEPAY_API_KEY', 'secret')
+    monkeypatch.setattr(app_module, 'send_thank_you_email', lambda *args: None)
+    with app_module.app.app_context():
+        user = User(username='b@example.com', email='b@example.com', total_donated=0)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    content = description.format(uid=user_id, hash=hashlib.md5(b'b@example.com').hexdigest())
+
+    # Webhook đã cộng tiền, lưu id SePay vào Donation.transaction_id
+    resp = app_module.app.test_client().post(
+        '/api/sepay-webhook', headers={'Authorization': 'Apikey secret'},
+        json={'id': 987654, 'referenceCode': 'FT24001', 'description': content, 'transferAmount': 20000})
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+
+    # Sao kê ngân hàng chỉ có mã tham chiếu, không có id SePay
+    statement = tmp_path / 'bank.csv'
+    statement.write_text(f'referenceCode,description,amount_in\nFT24001,{content},"20.000"\n', encoding='utf-8')
+    with app_module.app.app_context():
+        stats, unmatched = reconcile_sepay.reconcile(reconcile_sepay.load_statement(str(statement)))
+        assert stats['applied'] == 0
+        assert db.session.get(User, user_id).total_donated == 20000
+        assert Donation.query.count() == 1
+    assert [row['id'] for row, _ in unmatched] == ['FT24001']
+
+    # Sao kê SePay có id: nhận ra giao dịch webhook đã xử lý
+    statement = tmp_path / 'sepay.json'
+    statement.write_text(json.dumps([{'id': 987654, 'description': content, 'transferAmount': 20000}]),
+                         encoding='utf-8')
+    with app_module.app.app_context():
+        stats, unmatched = reconcile_sepay.reconcile(reconcile_sepay.load_statement(str(statement)))
+        assert stats['applied'] == 0
+        assert unmatched[0][1] == 'Giao dịch đã xử lý rồi'
@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import sqlite3
+import subprocess
+
+import pytest
+
+from shared_cache import SharedCache
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'cache.sqlite3')
+
+
+def test_single_flight_across_processes(cache_path, tmp_path):
+    counter = tmp_path / 'loads.txt'
+    # Các process cùng bắt đầu tại start_at, loader chậm 0.5s và ghi lại mỗi lần được gọi
+    script = (
+        'import sys, time\n'
+        'from shared_cache import SharedCache\n'
+        'cache = SharedCache(sys.argv[1])\n'
+        'def loader():\n'
+        '    with open(sys.argv[2], "a") as f:\n'
+        '        f.write("x\\n")\n'
+        '    time.sleep(0.5)\n'
+        '    return {"value": 42}\n'
+        'time.sleep(max(0, float(sys.argv[3]) - time.time()))\n'
+        'print(cache.get_or_refresh("catalog", "all", loader, 60)["value"])\n'
+    )
+    start_at = time.time() + 2
+    procs = [subprocess.Popen([sys.executable, '-c', script, cache_path, str(counter), str(start_at)],
+                              cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True)
+             for _ in range(6)]
+    outputs = [p.communicate(timeout=60)[0].strip() for p in procs]
+    assert all(p.returncode == 0 for p in procs)
+    assert outputs == ['42'] * 6
+    assert counter.read_text().count('x') == 1
+
+
+def test_stale_value_served_while_other_process_refreshes(cache_path):
+    cache = SharedCache(cache_path)
+    cache.set('catalog', 'all', 'old', ttl=0.05, stale_ttl=60)
+    time.sleep(0.1)
+    assert cache.get('catalog', 'all') is None
+    assert cache.peek('catalog', 'all') == 'old'
+
+    # Worker khác (owner khác) đang giữ khóa làm mới: trả bản cũ ngay, không gọi loader
+    other = SharedCache(cache_path)
+    full_key = other._full_key('catalog', 'all')
+    assert other._acquire(full_key)
+    try:
+        started = time.time()
+        assert cache.get_or_refresh('catalog', 'all', lambda: pytest.fail('loader không được gọi'), 60) == 'old'
+        assert time.time() - started < 1
+        assert cache.refresh('catalog', 'all', lambda: 'new', 60) is None
+    finally:
+        other._release(full_key)
+    assert cache.get_or_refresh('catalog', 'all', lambda: 'new', 60) == 'new'
+
+
+def test_loader_error_falls_back_to_stale(cache_path):
+    cache = SharedCache(cache_path)
+
+    def broken():
+        raise RuntimeError('upstream down')
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_refresh('catalog', 'all', broken, 60)
+    cache.set('catalog', 'all', 'old', ttl=0.05, stale_ttl=60)
+    time.sleep(0.1)
+    assert cache.get_or_refresh('catalog', 'all', broken, 60) == 'old'
+    # Khóa đã được trả sau khi loader lỗi
+    assert cache.get_or_refresh('catalog', 'all', lambda: 'new', 60) == 'new'
+
+
+def test_invalidate_bumps_namespace_version(cache_path):
+    cache = SharedCache(cache_path)
+    cache.set('leaderboard', 'top3', [1, 2, 3], ttl=60)
+    cache.set('catalog', 'all', 'keep', ttl=60)
+
+    # Worker khác xóa namespace: mọi process thấy ngay
+    SharedCache(cache_path).invalidate('leaderboard')
+    assert cache.get('leaderboard', 'top3') is None
+    assert cache.peek('leaderboard', 'top3') is None
+    assert cache.items('leaderboard') == []
+    assert cache.get('catalog', 'all') == 'keep'
+
+    cache.set('leaderboard', 'top3', [3, 2, 1], ttl=60)
+    assert cache.items('leaderboard') == [('top3', [3, 2, 1])]
+
+
+def test_eviction_drops_expired_then_oldest(cache_path):
+    # Mỗi giá trị 300 ký tự = 302 byte JSON: vừa 3 mục trong 1000 byte
+    cache = SharedCache(cache_path, max_bytes=1000)
+    cache.set('ns', 'expired', 'e' * 300, ttl=0, stale_ttl=0)
+    time.sleep(0.01)
+    for key in ('a', 'b'):
+        cache.set('ns', key, key * 300, ttl=60)
+        time.sleep(0.01)
+
+    cache.set('ns', 'c', 'c' * 300, ttl=60)
+    # Mục hết hạn bị xóa trước, mục cũ nhất còn hạn được giữ
+    assert cache.get('ns', 'a') == 'a' * 300
+    time.sleep(0.01)
+
+    cache.set('ns', 'd', 'd' * 300, ttl=60)
+    assert cache.get('ns', 'a') is None
+    assert sorted(key for key, _ in cache.items('ns')) == ['b', 'c', 'd']
+    with sqlite3.connect(cache_path) as conn:
+        assert conn.execute('SELECT SUM(size) FROM entries').fetchone()[0] <= 1000
+
+
+def test_webhook_succeeds_when_cache_invalidation_fails(app_module, monkeypatch):
+    import hashlib
+    db, User = app_module.db, app_module.User
+    monkeypatch.setenv('SEPAY_API_KEY', 'secret')
+    sent = []
+    monkeypatch.setattr(app_module, 'send_thank_you_email', lambda *args: sent.append(args))
+
+    def locked(namespace):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(app_module.shared_cache, 'invalidate', locked)
+    with app_module.app.app_context():
+        user = User(username='c@example.com', email='c@example.com', total_donated=0)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    content = f"WWM {user_id} {hashlib.md5(b'c@example.com').hexdigest()}"
+    resp = app_module.app.test_client().post(
+        '/api/sepay-webhook', headers={'Authorization': 'Apikey secret'},
+        json={'id': 555, 'description': content, 'transferAmount': 20000})
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    with app_module.app.app_context():
+        assert db.session.get(User, user_id).total_donated == 20000
+    assert len(sent) == 1